@@ -0,0 +1,125 @@
+"""
+Batch analysis of many GPX files, e.g. a race calendar or a club's route library.
+
+Files are analysed across a process pool, and each file's headline stats
+(see convert_gpx_data_to_row) are written as one NDJSON line as soon as it
+finishes, so results come back in completion order. The point arrays never
+leave the workers. The same rows are served by POST /batch.
+
+From the backend directory:
+
+    python batch.py data/gpx                           # NDJSON on stdout, summary table on stderr
+    python batch.py data/gpx extra.gpx --output results.ndjson --workers 4
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, Optional
+
+import pipeline
+
+# Columns of the summary table: (row key, heading, format)
+TABLE_COLUMNS = (
+    ("total_distance_km", "km", "{:.2f}"),
+    ("gain_m", "gain m", "{:.0f}"),
+    ("rolling_hills", "hills", "{}"),
+    ("grade", "grade %", "{:.2f}"),
+)
+
+
+def find_gpx_files(paths: Iterable[str]) -> List[str]:
+    """The .gpx files among paths, and in any directories among them."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.gpx"), recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def summarise_file(path: str, threshold: int = pipeline.THRESHOLD, num_splits: int = pipeline.NUM_SPLITS) -> dict:
+    # Runs in a worker, which reads the file itself so only the path is sent over
+    with open(path, "rb") as f:
+        return pipeline.summarise_gpx(f.read(), threshold, num_splits)
+
+
+def iter_batch(
+    paths: List[str],
+    threshold: int = pipeline.THRESHOLD,
+    num_splits: int = pipeline.NUM_SPLITS,
+    max_workers: Optional[int] = None,
+) -> Iterator[dict]:
+    """
+    Analyse the files on a process pool and yield {"name", ...stats} for each
+    as it finishes, or {"name", "error"} for files that could not be analysed.
+    """
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(summarise_file, path, threshold, num_splits): path for path in paths}
+        for future in as_completed(futures):
+            try:
+                yield {"name": futures[future], **future.result()}
+            except Exception as e:
+                yield {"name": futures[future], "error": str(e)}
+
+
+def batch_totals(rows: List[dict]) -> dict:
+    """The last line of a batch: how many files were analysed and their combined distance and gain."""
+    analysed = [row for row in rows if "error" not in row]
+    return {
+        "files": len(rows),
+        "failed": len(rows) - len(analysed),
+        "total_distance_km": sum(row["total_distance_km"] for row in analysed),
+        "gain_m": sum(row["gain_m"] for row in analysed),
+    }
+
+
+def format_table(rows: List[dict]) -> str:
+    """A plain text table of the rows, sorted by name."""
+    rows = sorted(rows, key=lambda row: row["name"])
+    cells = [["file"] + [heading for _, heading, _ in TABLE_COLUMNS]]
+    for row in rows:
+        if "error" not in row:
+            cells.append([row["name"]] + [fmt.format(row[key]) for key, _, fmt in TABLE_COLUMNS])
+    name_width = max(len(line[0]) for line in cells + [[row["name"]] for row in rows])
+    widths = [max(len(line[i]) for line in cells) for i in range(1, len(cells[0]))]
+
+    lines = []
+    for name, *values in cells:
+        lines.append("  ".join([name.ljust(name_width)] + [value.rjust(width) for value, width in zip(values, widths)]))
+    for row in rows:
+        if "error" in row:
+            lines.append(f"{row['name'].ljust(name_width)}  error: {row['error']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse many GPX files and print their headline stats.")
+    parser.add_argument("paths", nargs="+", help="GPX files or directories of them")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of CPUs")
+    parser.add_argument("--threshold", type=int, default=pipeline.THRESHOLD, help="rolling hill threshold")
+    parser.add_argument("--segments", type=int, default=pipeline.NUM_SPLITS, help="number of trail segments")
+    parser.add_argument("--output", help="write the NDJSON here instead of stdout")
+    args = parser.parse_args()
+
+    files = find_gpx_files(args.paths)
+    if not files:
+        sys.exit("No GPX files found.")
+
+    rows = []
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for row in iter_batch(files, args.threshold, args.segments, args.workers):
+            rows.append(row)
+            output.write(json.dumps(row) + "\n")
+            output.flush()
+        output.write(json.dumps(batch_totals(rows)) + "\n")
+    finally:
+        if args.output:
+            output.close()
+
+    print(format_table(rows), file=sys.stderr)
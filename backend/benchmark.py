@@ -0,0 +1,376 @@
+"""
+Benchmarks for the GPX analysis and LiDAR pipelines.
+
+Runs every stage of /format-gpx and /process-lidar over the bundled fixtures
+and over synthetic traces and point clouds, and reports per-stage wall time,
+peak traced allocations (tracemalloc) and the peak RSS of each case. Each
+case runs in a fresh process so peak RSS is per case, which is what sizing
+the worker pool (TRAIL_WORKERS) needs.
+
+From the backend directory:
+
+    python benchmark.py                   # run and compare against the baseline, if there is one
+    python benchmark.py --save            # run and store the results as the new baseline
+    python benchmark.py --sizes 1000 10000 --no-lidar
+
+Exits with status 1 when a stage is slower, or allocates more, than the
+baseline by more than --tolerance.
+"""
+import argparse
+import glob
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from lidar_util import get_real_path
+
+BASELINE_PATH = "data/benchmarks/baseline.json"
+SYNTHETIC_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+# LiDAR fixtures and the route flown over each of them
+LIDAR_FIXTURES = {
+    "../trailrunners/lidarFiles/honeyeater_small.laz": "data/gpx/honeyeater.gpx",
+    "../trailrunners/lidarFiles/honeyeater_mini.laz": "data/gpx/honeyeater.gpx",
+}
+
+# Synthetic data is placed near the fixtures, inside MGA zone 56
+SYNTHETIC_ORIGIN = (-27.44, 152.95)  # lat, lon
+SYNTHETIC_EXTENT = 0.02  # degrees
+SYNTHETIC_STEP = 3.0  # meters between trace points
+SYNTHETIC_ROUTE_POINTS = 2_000  # route length for the synthetic point clouds
+
+# Differences below these are noise, not regressions
+MIN_WALL_DELTA = 0.002  # seconds
+MIN_ALLOC_DELTA = 64 * 1024  # bytes
+
+
+def _peak_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _fold(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    # Reflect a walk back into [low, high] so long traces stay in the same area
+    span = high - low
+    return low + span - np.abs(np.mod(values - low, 2 * span) - span)
+
+
+def synthetic_trace(num_points: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return (lat, lon, ele) of a smooth random walk with a point every SYNTHETIC_STEP meters."""
+    rng = np.random.default_rng(seed)
+    heading = np.cumsum(rng.normal(0.0, 0.2, num_points))
+    step = SYNTHETIC_STEP / 111_320  # meters to degrees of latitude
+    lat0, lon0 = SYNTHETIC_ORIGIN
+    lat = _fold(lat0 + np.cumsum(np.sin(heading)) * step, lat0 - SYNTHETIC_EXTENT / 2, lat0 + SYNTHETIC_EXTENT / 2)
+    lon = _fold(
+        lon0 + np.cumsum(np.cos(heading)) * step / math.cos(math.radians(lat0)),
+        lon0 - SYNTHETIC_EXTENT / 2,
+        lon0 + SYNTHETIC_EXTENT / 2,
+    )
+    ele = 200 + 40 * np.sin(np.arange(num_points) / 500) + np.cumsum(rng.normal(0.0, 0.3, num_points)) * 0.1
+    return lat, lon, ele
+
+
+def write_synthetic_gpx(path: str, num_points: int, seed: int = 0):
+    lat, lon, ele = synthetic_trace(num_points, seed)
+    with open(path, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<gpx version="1.1" creator="benchmark" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        f.write("<trk><name>synthetic</name><trkseg>\n")
+        f.writelines(
+            f'<trkpt lat="{la:.7f}" lon="{lo:.7f}"><ele>{el:.2f}</ele></trkpt>\n'
+            for la, lo, el in zip(lat.tolist(), lon.tolist(), ele.tolist())
+        )
+        f.write("</trkseg></trk>\n</gpx>\n")
+
+
+def write_synthetic_laz(path: str, num_points: int, route_points: int = SYNTHETIC_ROUTE_POINTS, seed: int = 0):
+    """
+    Write a point cloud over the synthetic route of route_points points:
+    half scattered over its bounding box, half within a few meters of the route.
+    """
+    import laspy
+    from pyproj import CRS
+
+    from projection import DEFAULT_PROJECTED_EPSG, get_transformer
+
+    rng = np.random.default_rng(seed + 1)
+    lat, lon, ele = synthetic_trace(route_points, seed)
+    x, y = get_transformer(4326, DEFAULT_PROJECTED_EPSG).transform(lon, lat)
+
+    near = num_points // 2
+    picks = rng.integers(0, route_points, near)
+    xs = np.concatenate((rng.uniform(x.min(), x.max(), num_points - near), x[picks] + rng.normal(0, 2, near)))
+    ys = np.concatenate((rng.uniform(y.min(), y.max(), num_points - near), y[picks] + rng.normal(0, 2, near)))
+    zs = np.concatenate((rng.uniform(ele.min(), ele.max() + 20, num_points - near), ele[picks] + rng.exponential(1.0, near)))
+
+    header = laspy.LasHeader(point_format=0, version="1.4")
+    header.scales = np.array([0.01, 0.01, 0.01])
+    header.offsets = np.array([xs.min(), ys.min(), zs.min()])
+    header.add_crs(CRS.from_epsg(DEFAULT_PROJECTED_EPSG))
+    las = laspy.LasData(header)
+    las.x, las.y, las.z = xs, ys, zs
+    las.write(path)
+
+
+def _gpx_stages(gpx_path: str) -> List[Tuple[str, Callable]]:
+    from parseGpx import convert_gpx_data_to_json, handle_gpx_stats, parse_gpx
+    from trail_format import encode_trail_columns
+
+    with open(gpx_path, "rb") as f:
+        gpx_bytes = f.read()
+    state = {}
+
+    def parse():
+        state["gpx_data"] = parse_gpx(io.BytesIO(gpx_bytes))
+
+    def stats():
+        handle_gpx_stats(state["gpx_data"])
+
+    def encode_json():
+        json.dumps(convert_gpx_data_to_json(state["gpx_data"]))
+
+    def encode_columns():
+        encode_trail_columns(state["gpx_data"], trail_id="")
+
+    return [("parse", parse), ("stats", stats), ("json", encode_json), ("columns", encode_columns)]
+
+
+def _lidar_stages(laz_path: str, gpx_path: str) -> List[Tuple[str, Callable]]:
+    from lidar_util import read_lidar_near_route
+    from parseGpx import convert_gpx_data_to_json, handle_gpx_stats, parse_gpx
+    from parseLidar import fuse_elevations, link_elevations
+
+    with open(gpx_path, "rb") as f:
+        gpx_bytes = f.read()
+    state = {}
+
+    def parse():
+        state["gpx_data"] = parse_gpx(io.BytesIO(gpx_bytes))
+
+    def crop():
+        state["las"] = read_lidar_near_route(laz_path, state["gpx_data"], margin=0.001)
+
+    def link():
+        state["lidar_elevations"] = link_elevations(state["las"], state["gpx_data"], distance_thresh=1.5)
+
+    def fuse():
+        fusion = fuse_elevations(state["lidar_elevations"], state["gpx_data"].elevations, max_gap=1.5)
+        state["gpx_data"].elevations = fusion
+
+    def stats():
+        handle_gpx_stats(state["gpx_data"])
+
+    def encode_json():
+        json.dumps(convert_gpx_data_to_json(state["gpx_data"]))
+
+    return [
+        ("parse", parse),
+        ("crop", crop),
+        ("link", link),
+        ("fuse", fuse),
+        ("stats", stats),
+        ("json", encode_json),
+    ]
+
+
+def run_case(case: dict, repeat: int) -> dict:
+    """Run one case in this process. Called in a fresh worker process by run_cases."""
+    if case["kind"] == "gpx":
+        stages = _gpx_stages(case["gpx"])
+    else:
+        stages = _lidar_stages(case["laz"], case["gpx"])
+
+    # Untraced passes for wall time, stages run in order since each feeds the next
+    walls: Dict[str, List[float]] = {name: [] for name, _ in stages}
+    for _ in range(repeat):
+        for name, stage in stages:
+            start = time.perf_counter()
+            stage()
+            walls[name].append(time.perf_counter() - start)
+
+    # One traced pass for allocations, tracemalloc slows everything down too much to time
+    allocs = {}
+    tracemalloc.start()
+    for name, stage in stages:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        stage()
+        after, peak = tracemalloc.get_traced_memory()
+        allocs[name] = {"peak_alloc": peak - before, "retained": after - before}
+    tracemalloc.stop()
+
+    return {
+        "kind": case["kind"],
+        "points": case.get("points"),
+        "stages": {
+            name: {
+                "wall": statistics.median(walls[name]),
+                "wall_min": min(walls[name]),
+                **allocs[name],
+            }
+            for name, _ in stages
+        },
+        "peak_rss": _peak_rss(),
+    }
+
+
+def collect_cases(sizes, work_dir: str, lidar: bool = True, fixtures: bool = True) -> Dict[str, dict]:
+    cases = {}
+    if fixtures:
+        gpx_paths = sorted(
+            glob.glob(get_real_path("data/gpx/*.gpx"))
+            + glob.glob(get_real_path("../trailrunners/trails/*.gpx"))
+        )
+        for path in gpx_paths:
+            cases[f"gpx/{os.path.basename(path)}"] = {"kind": "gpx", "gpx": path}
+        if lidar:
+            for laz_path, gpx_path in LIDAR_FIXTURES.items():
+                laz_path, gpx_path = get_real_path(laz_path), get_real_path(gpx_path)
+                if os.path.exists(laz_path) and os.path.exists(gpx_path):
+                    cases[f"lidar/{os.path.basename(laz_path)}"] = {"kind": "lidar", "laz": laz_path, "gpx": gpx_path}
+
+    route_path = None
+    for size in sizes:
+        gpx_path = os.path.join(work_dir, f"synthetic_{size}.gpx")
+        write_synthetic_gpx(gpx_path, size)
+        cases[f"gpx/synthetic_{size}"] = {"kind": "gpx", "gpx": gpx_path, "points": size}
+
+        if lidar:
+            if route_path is None:
+                route_path = os.path.join(work_dir, "synthetic_route.gpx")
+                write_synthetic_gpx(route_path, SYNTHETIC_ROUTE_POINTS)
+            laz_path = os.path.join(work_dir, f"synthetic_{size}.laz")
+            write_synthetic_laz(laz_path, size)
+            cases[f"lidar/synthetic_{size}"] = {"kind": "lidar", "laz": laz_path, "gpx": route_path, "points": size}
+    return cases
+
+
+def run_cases(cases: Dict[str, dict], repeat: int) -> Dict[str, dict]:
+    results = {}
+    # A new process per case, so imports are warm but peak RSS starts fresh
+    with ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context("spawn"), max_tasks_per_child=1
+    ) as pool:
+        for name, case in cases.items():
+            print(f"running {name}", file=sys.stderr)
+            try:
+                results[name] = pool.submit(run_case, case, repeat).result()
+            except ValueError as e:
+                # e.g. waypoint_file.gpx, which has no track or route to analyse
+                print(f"skip {name}: {e}", file=sys.stderr)
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """Return a description of every stage that regressed against the baseline."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for stage, current in result["stages"].items():
+            before = previous["stages"].get(stage)
+            if before is None:
+                continue
+            for key, min_delta in (("wall", MIN_WALL_DELTA), ("peak_alloc", MIN_ALLOC_DELTA)):
+                delta = current[key] - before[key]
+                if delta > min_delta and current[key] > before[key] * (1 + tolerance):
+                    regressions.append(
+                        f"{name} {stage} {key}: {_format(key, before[key])} -> {_format(key, current[key])}"
+                    )
+    return regressions
+
+
+def _format(key: str, value) -> str:
+    if value is None:
+        return "-"
+    if key.startswith("wall"):
+        return f"{value * 1000:.1f} ms"
+    return f"{value / (1024 * 1024):.1f} MiB"
+
+
+def print_table(results: dict):
+    print(f"{'case':<36} {'stage':<8} {'wall':>11} {'peak alloc':>11} {'retained':>11} {'peak rss':>11}")
+    for name, result in results.items():
+        for i, (stage, values) in enumerate(result["stages"].items()):
+            rss = _format("rss", result["peak_rss"]) if i == 0 else ""
+            print(
+                f"{name if i == 0 else '':<36} {stage:<8} {_format('wall', values['wall']):>11} "
+                f"{_format('alloc', values['peak_alloc']):>11} {_format('alloc', values['retained']):>11} {rss:>11}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the GPX analysis and LiDAR pipelines.")
+    parser.add_argument("--sizes", type=int, nargs="*", default=list(SYNTHETIC_SIZES), help="synthetic trace and point cloud sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case, the median is reported")
+    parser.add_argument("--no-lidar", action="store_true", help="skip the LiDAR cases")
+    parser.add_argument("--no-fixtures", action="store_true", help="only run the synthetic cases")
+    parser.add_argument("--only", help="only run cases whose name contains this")
+    parser.add_argument("--baseline", default=get_real_path(BASELINE_PATH), help="baseline JSON file")
+    parser.add_argument("--save", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--output", help="also write these results to a JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown or growth before flagging, as a fraction")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="trail-benchmark-") as work_dir:
+        cases = collect_cases(args.sizes, work_dir, lidar=not args.no_lidar, fixtures=not args.no_fixtures)
+        if args.only:
+            cases = {name: case for name, case in cases.items() if args.only in name}
+        results = run_cases(cases, args.repeat)
+
+    print_table(results)
+    report = {
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+        },
+        "created_at": time.time(),
+        "repeat": args.repeat,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=4)
+
+    status = 0
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%} of {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            status = 1
+        else:
+            print(f"\nNo regressions beyond {args.tolerance:.0%} of {args.baseline}")
+    sys.exit(status)
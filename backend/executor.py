@@ -0,0 +1,151 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+import telemetry
+
+# Configuration, overridable through the environment
+EXECUTOR_KIND = os.environ.get("TRAIL_EXECUTOR", "process")  # "process" or "thread"
+MAX_WORKERS = int(os.environ.get("TRAIL_WORKERS", os.cpu_count() or 1))
+MAX_QUEUED = int(os.environ.get("TRAIL_QUEUE_SIZE", 16))
+JOB_TIMEOUT = float(os.environ.get("TRAIL_JOB_TIMEOUT", 300))
+
+
+class ExecutorBusy(Exception):
+    """Raised when every worker is busy and the queue is full."""
+
+
+class JobTimeout(Exception):
+    """Raised when a job does not finish within its timeout."""
+
+
+def _init_worker():
+    # Pay the heavy imports and PROJ setup once per worker, not per job
+    import laspy  # noqa: F401
+    import numpy  # noqa: F401
+    import scipy.ndimage  # noqa: F401
+    import scipy.spatial  # noqa: F401
+
+    import pipeline  # noqa: F401
+    from projection import warm_transformers
+
+    warm_transformers()
+
+
+def _ready():
+    return True
+
+
+class PipelineExecutor:
+    """
+    Runs CPU-bound pipeline stages off the event loop, on a thread or process pool.
+
+    At most max_workers jobs run at once and max_queued more may wait. Beyond
+    that, run raises ExecutorBusy. A job still running after its timeout raises
+    JobTimeout for the caller. Process workers cannot be interrupted, so the
+    job keeps its worker until it finishes, and it still counts against the queue.
+    """
+
+    def __init__(
+        self,
+        kind: str = EXECUTOR_KIND,
+        max_workers: int = MAX_WORKERS,
+        max_queued: int = MAX_QUEUED,
+        timeout: float = JOB_TIMEOUT,
+    ):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self._pool: Optional[Executor] = None
+        self._manager = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def full(self) -> bool:
+        return self._in_flight >= self.max_workers + self.max_queued
+
+    def make_queue(self):
+        """Return a queue that jobs on this executor can put to, e.g. for progress."""
+        if self.kind == "thread":
+            return queue.Queue()
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+        return self._manager.Queue()
+
+    def start(self):
+        if self._pool is not None:
+            return
+        if self.kind == "process":
+            # spawn rather than fork, the server process may already have threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+            )
+            # Workers are spawned on demand, start them all now instead of on the first requests
+            for _ in range(self.max_workers):
+                self._pool.submit(_ready)
+        else:
+            self._pool = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="pipeline"
+            )
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+
+    def _release(self, _future=None):
+        with self._lock:
+            self._in_flight -= 1
+
+    async def run(self, fn: Callable, *args, timeout: Optional[float] = None):
+        """Run fn(*args) on the pool and wait for its result."""
+        self.start()
+
+        with self._lock:
+            if self.full:
+                raise ExecutorBusy()
+            self._in_flight += 1
+
+        # Workers can't see the caller's trace, so they send their spans back with the result
+        traced = telemetry.tracing()
+        with telemetry.span("worker"):
+            try:
+                if traced:
+                    future = self._pool.submit(telemetry.run_traced, fn, *args)
+                else:
+                    future = self._pool.submit(fn, *args)
+            except BaseException:
+                self._release()
+                raise
+            # Released when the job really finishes, even if the caller timed out
+            future.add_done_callback(self._release)
+
+            try:
+                result = await asyncio.wait_for(
+                    asyncio.wrap_future(future), timeout or self.timeout
+                )
+            except asyncio.TimeoutError:
+                future.cancel()
+                raise JobTimeout()
+
+        if traced:
+            result, spans = result
+            telemetry.add_spans(spans)
+        return result
@@ -1,42 +1,135 @@
-import xml.etree.ElementTree as ET
-from datetime import datetime, timezone
 import os
+from dataclasses import dataclass
+from typing import Iterator, List
 
-def convert_to_gpx(input_file, output_filename="output.gpx"):
-    # Get script directory
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    output_file = os.path.join(script_dir, output_filename)
+import numpy as np
 
-    # Create GPX root
-    gpx = ET.Element("gpx", version="1.1", creator="GNSS Converter",
-                     xmlns="http://www.topografix.com/GPX/1/1")
+from parseGpx import GPXData, gpx_data_from_points
+import telemetry
 
-    trk = ET.SubElement(gpx, "trk")
-    trkseg = ET.SubElement(trk, "trkseg")
+# Columns of a GnssLogger "Fix" row:
+# Fix,Provider,LatitudeDegrees,LongitudeDegrees,AltitudeMeters,SpeedMps,AccuracyMeters,BearingDegrees,UnixTimeMillis,...
+FIX_PREFIX = b"Fix,"
+FIX_FIELDS = (2, 3, 4, 8)
 
-    with open(input_file, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line.startswith("Fix,"):
-                continue  # skip everything else
+GPX_HEADER = (
+    b"<?xml version='1.0' encoding='utf-8'?>\n"
+    b'<gpx version="1.1" creator="GNSS Converter" xmlns="http://www.topografix.com/GPX/1/1">'
+    b"<trk><trkseg>\n"
+)
+GPX_FOOTER = b"</trkseg></trk></gpx>\n"
 
-            parts = line.split(",")
 
+@dataclass
+class GnssFixes:
+    """The position fixes of a GNSS log, one array per field."""
+
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    elevations: np.ndarray
+    times_ms: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+
+def _parse_fix_rows(rows: List[bytes]) -> np.ndarray:
+    # (n, 4) array of latitude, longitude, elevation and time of the well-formed rows
+    fields = [row.split(b",", 9) for row in rows]
+    table = [[parts[i] for i in FIX_FIELDS] for parts in fields if len(parts) > FIX_FIELDS[-1]]
+    try:
+        return np.array(table, dtype=bytes).astype(np.float64).reshape(-1, len(FIX_FIELDS))
+    except ValueError:
+        # Some row has an empty or malformed field, skip it
+        values = []
+        for row in table:
             try:
-                lat = float(parts[2])
-                lon = float(parts[3])
-                ele = float(parts[4])
-                t_ms = int(parts[8])
-
-                # Convert Unix ms → ISO 8601 UTC
-                time_str = datetime.fromtimestamp(t_ms / 1000, tz=timezone.utc).isoformat()
-
-                trkpt = ET.SubElement(trkseg, "trkpt", lat=str(lat), lon=str(lon))
-                ET.SubElement(trkpt, "ele").text = str(ele)
-                ET.SubElement(trkpt, "time").text = time_str
-            except Exception:
-                continue  # skip malformed rows
-
-    # Write GPX
-    tree = ET.ElementTree(gpx)
-    tree.write(output_file, encoding="utf-8", xml_declaration=True)
\ No newline at end of file
+                values.append([float(value) for value in row])
+            except ValueError:
+                continue
+        return np.array(values, dtype=np.float64).reshape(-1, len(FIX_FIELDS))
+
+
+def read_gnss_fixes(log_file, chunk_size: int = 1024 * 1024, digest=None) -> GnssFixes:
+    """
+    Read the "Fix" rows of a GnssLogger text log (a path or a binary file
+    object) into arrays. The log is read in chunks and only the fix rows
+    are parsed, so memory grows with the number of fixes, not the size of
+    the log. If given, digest (e.g. a hashlib.sha256()) is updated with
+    every byte read.
+    """
+    if isinstance(log_file, (str, os.PathLike)):
+        with open(log_file, "rb") as f:
+            return read_gnss_fixes(f, chunk_size, digest)
+
+    parsed = []
+    with telemetry.span("read_gnss") as stage:
+        remainder = b""
+        read = 0
+        while True:
+            chunk = log_file.read(chunk_size)
+            if digest is not None:
+                digest.update(chunk)
+            read += len(chunk)
+            lines = (remainder + chunk).split(b"\n")
+            # The last line may continue in the next chunk
+            remainder = lines.pop() if chunk else b""
+            rows = [line.rstrip(b"\r") for line in lines if line.startswith(FIX_PREFIX)]
+            if rows:
+                parsed.append(_parse_fix_rows(rows))
+            if not chunk:
+                break
+
+        values = np.concatenate(parsed) if parsed else np.empty((0, len(FIX_FIELDS)))
+        stage.set(bytes=read, points=len(values))
+
+    return GnssFixes(
+        latitudes=values[:, 0].copy(),
+        longitudes=values[:, 1].copy(),
+        elevations=values[:, 2].copy(),
+        times_ms=values[:, 3].astype(np.int64),
+    )
+
+
+def _iso_times(times_ms: np.ndarray) -> List[str]:
+    # Same as datetime.fromtimestamp(t_ms / 1000, tz=timezone.utc).isoformat(), which leaves out zero microseconds
+    times = times_ms.astype("datetime64[ms]")
+    with_fraction = np.datetime_as_string(times, unit="us")
+    whole_seconds = np.datetime_as_string(times, unit="s")
+    strings = np.where(times_ms % 1000 == 0, whole_seconds, with_fraction)
+    return [f"{string}+00:00" for string in strings.tolist()]
+
+
+def iter_gpx(fixes: GnssFixes, chunk_points: int = 10_000) -> Iterator[bytes]:
+    """Yield a GPX track of the fixes in pieces of chunk_points points, e.g. for a streaming response."""
+    yield GPX_HEADER
+    for start in range(0, len(fixes), chunk_points):
+        end = start + chunk_points
+        points = zip(
+            fixes.latitudes[start:end].tolist(),
+            fixes.longitudes[start:end].tolist(),
+            fixes.elevations[start:end].tolist(),
+            _iso_times(fixes.times_ms[start:end]),
+        )
+        yield "".join(
+            f'<trkpt lat="{lat}" lon="{lon}"><ele>{ele}</ele><time>{time}</time></trkpt>\n'
+            for lat, lon, ele, time in points
+        ).encode("utf-8")
+    yield GPX_FOOTER
+
+
+def gnss_to_gpx_data(fixes: GnssFixes) -> GPXData:
+    """GPXData of the fixes, as parse_gpx would give for the converted GPX."""
+    if len(fixes) == 0:
+        raise ValueError("No GNSS fixes found in the log.")
+    # gpx_data_from_points shifts the elevations in place, keep the fixes as read
+    return gpx_data_from_points(fixes.latitudes, fixes.longitudes, fixes.elevations.copy())
+
+
+def convert_to_gpx(input_file, output_file="output.gpx") -> int:
+    """Convert a GnssLogger log to a GPX file at output_file and return the number of points."""
+    fixes = read_gnss_fixes(input_file)
+    with open(output_file, "wb") as f:
+        for piece in iter_gpx(fixes):
+            f.write(piece)
+    return len(fixes)
@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+from lidar_util import get_real_path
+
+JOBS_DIR = "data/jobs"
+
+# Stages reported by pipeline.process_lidar_tiles, in order
+STAGES = ("read", "crop", "index", "link", "fuse", "stats")
+
+
+class JobStore:
+    """
+    Status, progress and results of background jobs.
+
+    Only the status and progress of jobs are kept in memory. Finished jobs
+    (done or failed) are written to results_dir as <job_id>.json, and their
+    results are only ever read back from there, so they survive a restart
+    and don't add up in memory. Only the newest max_files files are kept.
+    """
+
+    def __init__(
+        self,
+        results_dir: str = get_real_path(JOBS_DIR),
+        max_jobs: int = 100,
+        max_files: int = 200,
+    ):
+        self.results_dir = results_dir
+        self.max_jobs = max_jobs
+        self.max_files = max_files
+        self._jobs: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self) -> str:
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "stage": None,
+                "stages": list(STAGES),
+                "events": [],
+                "error": None,
+                "created_at": time.time(),
+                "finished_at": None,
+            }
+            self._evict()
+        return job_id
+
+    def set_stage(self, job_id: str, stage: str, timestamp: Optional[float] = None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            # Late progress from a worker must not reopen a finished job
+            if job is None or job["status"] in ("done", "failed"):
+                return
+            job["status"] = "running"
+            job["stage"] = stage
+            job["events"].append({"stage": stage, "time": timestamp or time.time()})
+
+    def finish(self, job_id: str, result: dict):
+        self._complete(job_id, "done", result=result)
+
+    def fail(self, job_id: str, message: str):
+        self._complete(job_id, "failed", error=message)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Job status and progress, without the result payload."""
+        job = self._load(job_id)
+        if job is None:
+            return None
+        return {key: value for key, value in job.items() if key != "result"}
+
+    def get_result(self, job_id: str) -> Optional[dict]:
+        """The full job record, including the result (read from results_dir) once it is done."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] != "done":
+                return dict(job)
+        return self._read(job_id)
+
+    def listen(self, queue):
+        """Apply (job_id, stage, timestamp) progress messages from queue on a background thread."""
+
+        def drain():
+            while True:
+                try:
+                    message = queue.get()
+                except (EOFError, OSError):
+                    # The queue's manager was shut down
+                    return
+                if message is None:
+                    return
+                self.set_stage(*message)
+
+        threading.Thread(target=drain, name="job-progress", daemon=True).start()
+
+    def _complete(self, job_id: str, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            finished = {"status": status, "error": error, "finished_at": time.time()}
+            record = {**job, **finished, "events": list(job["events"]), "result": result}
+        try:
+            self._save(record)
+        except OSError as e:
+            # Without the file there is no result to serve
+            finished = {"status": "failed", "error": f"Could not save the job result: {e}", "finished_at": time.time()}
+
+        # Marked finished only once the file is written, so the result can be read as soon as it's done
+        with self._lock:
+            job.update(finished)
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return dict(job)
+
+        # Fall back to finished jobs on disk (evicted, or from before a restart)
+        return self._read(job_id)
+
+    def _read(self, job_id: str) -> Optional[dict]:
+        path = self._path(job_id)
+        if path is None:
+            return None
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            # Never finished, or pruned to keep max_files
+            return None
+
+    def _path(self, job_id: str) -> Optional[str]:
+        # Job ids are uuid4 hex, anything else can't be a file of ours
+        if len(job_id) != 32 or not all(c in "0123456789abcdef" for c in job_id):
+            return None
+        return os.path.join(self.results_dir, f"{job_id}.json")
+
+    def _save(self, record: dict):
+        os.makedirs(self.results_dir, exist_ok=True)
+        path = self._path(record["job_id"])
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+        files = sorted(
+            (entry for entry in os.scandir(self.results_dir) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        for entry in files[: max(0, len(files) - self.max_files)]:
+            os.remove(entry.path)
+
+    def _evict(self):
+        # Finished jobs are on disk, so drop the oldest of those from memory first
+        while len(self._jobs) > self.max_jobs:
+            finished = next(
+                (k for k, job in self._jobs.items() if job["status"] in ("done", "failed")),
+                None,
+            )
+            if finished is None:
+                return
+            del self._jobs[finished]
@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+import laspy
+import numpy as np
+
+from lidar_util import LidarPoints, RouteCorridor, densify_route, get_real_path
+from parseGpx import GPXData
+from projection import DEFAULT_PROJECTED_EPSG, get_transformer
+
+INDEX_ROOT = "data/lidar/index"
+MANIFEST_NAME = "manifest.json"
+INDEX_VERSION = 2
+# Version 1 indexes have no classification, they are still read
+SUPPORTED_VERSIONS = (1, 2)
+
+# On-disk layout of each cell, memory-mappable with np.load(mmap_mode="r")
+POINT_DTYPE = np.dtype([("x", "<f8"), ("y", "<f8"), ("z", "<f8"), ("classification", "u1")])
+
+
+def get_index_path(name: str) -> str:
+    return get_real_path(os.path.join(INDEX_ROOT, name))
+
+
+def _cell_key(ix: int, iy: int) -> str:
+    return f"{ix}_{iy}"
+
+
+def build_tile_index(
+    laz_path: str,
+    index_dir: str,
+    cell_size: float = 100.0,
+    las_crs_epsg: int = DEFAULT_PROJECTED_EPSG,
+    chunk_size: int = 1_000_000,
+) -> dict:
+    """
+    Split a LAS/LAZ file into a grid of uncompressed on-disk cells plus a manifest.
+
+    The source is streamed chunk by chunk. Each chunk's points are appended
+    to a raw file per grid cell, then every cell is rewritten as a .npy
+    file, so memory stays bounded by one chunk plus the largest cell.
+    """
+    cells_dir = os.path.join(index_dir, "cells")
+    if os.path.exists(index_dir):
+        shutil.rmtree(index_dir)
+    os.makedirs(cells_dir)
+
+    counts: Dict[Tuple[int, int], int] = {}
+    selection = (
+        laspy.DecompressionSelection.XY_RETURNS_CHANNEL
+        | laspy.DecompressionSelection.Z
+        | laspy.DecompressionSelection.CLASSIFICATION
+    )
+    with laspy.open(laz_path, decompression_selection=selection) as reader:
+        header = reader.header
+        for points in reader.chunk_iterator(chunk_size):
+            chunk = np.empty(len(points), dtype=POINT_DTYPE)
+            chunk["x"] = points.x
+            chunk["y"] = points.y
+            chunk["z"] = points.z
+            chunk["classification"] = points.classification
+
+            # Group the chunk by grid cell and append each group to its cell
+            cell_x = np.floor(chunk["x"] / cell_size).astype(np.int64)
+            cell_y = np.floor(chunk["y"] / cell_size).astype(np.int64)
+            order = np.lexsort((cell_y, cell_x))
+            chunk, cell_x, cell_y = chunk[order], cell_x[order], cell_y[order]
+            starts = np.flatnonzero(
+                np.concatenate(([True], (np.diff(cell_x) != 0) | (np.diff(cell_y) != 0)))
+            )
+            ends = np.append(starts[1:], len(chunk))
+
+            for start, end in zip(starts, ends):
+                cell = (int(cell_x[start]), int(cell_y[start]))
+                with open(os.path.join(cells_dir, _cell_key(*cell) + ".raw"), "ab") as f:
+                    chunk[start:end].tofile(f)
+                counts[cell] = counts.get(cell, 0) + int(end - start)
+
+    crs = header.parse_crs()
+    if crs is not None and crs.to_epsg() is not None:
+        las_crs_epsg = crs.to_epsg()
+
+    cells = {}
+    for (ix, iy), count in counts.items():
+        key = _cell_key(ix, iy)
+        raw_path = os.path.join(cells_dir, key + ".raw")
+        cell_points = np.fromfile(raw_path, dtype=POINT_DTYPE)
+        np.save(os.path.join(cells_dir, key + ".npy"), cell_points)
+        os.remove(raw_path)
+
+        cells[key] = {
+            "file": f"cells/{key}.npy",
+            "count": count,
+            "bounds": [ix * cell_size, iy * cell_size, (ix + 1) * cell_size, (iy + 1) * cell_size],
+        }
+
+    manifest = {
+        "version": INDEX_VERSION,
+        "source": os.path.basename(laz_path),
+        "crs_epsg": las_crs_epsg,
+        "cell_size": cell_size,
+        "point_count": int(sum(counts.values())),
+        "bounds": [
+            float(header.mins[0]),
+            float(header.mins[1]),
+            float(header.maxs[0]),
+            float(header.maxs[1]),
+        ],
+        "cells": cells,
+    }
+    with open(os.path.join(index_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+    return manifest
+
+
+def route_cells(
+    x: np.ndarray, y: np.ndarray, cell_size: float, buffer: float
+) -> List[Tuple[int, int]]:
+    """
+    Return the grid cells within `buffer` meters of a projected route polyline.
+    The route is densified to half a cell so long straight sections don't skip cells.
+    """
+    # Subdivide each section into steps of at most half a cell
+    dense_x, dense_y = densify_route(x, y, cell_size / 2)
+
+    reach = int(np.ceil(buffer / cell_size))
+    offsets = np.arange(-reach, reach + 1)
+    cell_x = np.floor(dense_x / cell_size).astype(np.int64)[:, None] + offsets
+    cell_y = np.floor(dense_y / cell_size).astype(np.int64)[:, None] + offsets
+    cells = np.column_stack(
+        (
+            np.repeat(cell_x, offsets.size, axis=1).ravel(),
+            np.tile(cell_y, offsets.size).ravel(),
+        )
+    )
+    return [tuple(cell) for cell in np.unique(cells, axis=0).tolist()]
+
+
+class LidarTileIndex:
+    """Read-only view of a tile index built by build_tile_index."""
+
+    def __init__(self, index_dir: str):
+        manifest_path = os.path.join(index_dir, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"LiDAR index not found at: {index_dir}")
+
+        with open(manifest_path, "r") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported LiDAR index version in {manifest_path}")
+
+        self.index_dir = index_dir
+        self.cell_size = float(self.manifest["cell_size"])
+        self.crs_epsg = int(self.manifest["crs_epsg"])
+
+    def load_cell(self, key: str) -> Optional[np.ndarray]:
+        cell = self.manifest["cells"].get(key)
+        if cell is None:
+            return None
+        return np.load(os.path.join(self.index_dir, cell["file"]), mmap_mode="r")
+
+    def read_route(
+        self, gpx_data: GPXData, buffer: float = 10.0
+    ) -> LidarPoints:
+        """
+        Return the points within `buffer` meters of the route, reading only
+        the cells the corridor passes through.
+        """
+        transformer = get_transformer(4326, self.crs_epsg)
+        x, y = transformer.transform(gpx_data.longitudes, gpx_data.latitudes)
+        corridor = RouteCorridor(x, y, buffer)
+
+        xs, ys, zs, classes = [], [], [], []
+        for cell in route_cells(x, y, self.cell_size, buffer):
+            points = self.load_cell(_cell_key(*cell))
+            if points is None:
+                continue
+
+            # The records interleave x, y, z and classification, so the x/y mask reads
+            # every page of the mapped cell. Only the kept points are copied into memory.
+            kept = points[corridor.mask(points["x"], points["y"])]
+            xs.append(kept["x"])
+            ys.append(kept["y"])
+            zs.append(kept["z"])
+            if "classification" in kept.dtype.names:
+                classes.append(kept["classification"])
+
+        if not xs:
+            return LidarPoints(np.empty(0), np.empty(0), np.empty(0), self.crs_epsg)
+        return LidarPoints(
+            np.concatenate(xs),
+            np.concatenate(ys),
+            np.concatenate(zs),
+            self.crs_epsg,
+            np.concatenate(classes) if classes else None,
+        )
+
+
+def list_indexes() -> List[str]:
+    root = get_real_path(INDEX_ROOT)
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(root)
+        if os.path.exists(os.path.join(root, name, MANIFEST_NAME))
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Split a LAS/LAZ file into a memory-mappable tile index."
+    )
+    parser.add_argument("laz_path", help="LAS/LAZ file to ingest")
+    parser.add_argument(
+        "--name", help="index name (defaults to the file name without extension)"
+    )
+    parser.add_argument(
+        "--cell-size", type=float, default=100.0, help="grid cell size in meters"
+    )
+    parser.add_argument(
+        "--epsg", type=int, default=DEFAULT_PROJECTED_EPSG, help="CRS of the file if its header has none"
+    )
+    args = parser.parse_args()
+
+    name = args.name or os.path.splitext(os.path.basename(args.laz_path))[0]
+    manifest = build_tile_index(
+        os.path.abspath(args.laz_path),
+        get_index_path(name),
+        cell_size=args.cell_size,
+        las_crs_epsg=args.epsg,
+    )
+    print(
+        f"Indexed {manifest['point_count']} points into {len(manifest['cells'])} cells at {get_index_path(name)}"
+    )
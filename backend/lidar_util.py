@@ -1,11 +1,87 @@
+import io
 import os
 import numpy as np
-from typing import Tuple
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
 import laspy
+from scipy.ndimage import maximum_filter
 from scipy.spatial import KDTree
-from pyproj import Transformer
 from parseGpx import GPXData, parse_gpx
 from pyproj import CRS
+from projection import DEFAULT_PROJECTED_EPSG, get_transformer, route_epsg
+import telemetry
+
+
+# Directories of registered LAS/LAZ tiles, one per survey, see list_tile_sets
+TILES_ROOT = "data/lidar/tiles"
+LIDAR_EXTENSIONS = (".laz", ".las")
+
+# ASPRS LAS classification code of ground returns
+GROUND_CLASS = 2
+
+# LiDAR points farther than this many meters from the route are never read
+CORRIDOR_WIDTH = 10.0
+# Upper bound on the cells of a RouteCorridor's lookup grid, one byte each
+MAX_CORRIDOR_CELLS = 4_000_000
+# RouteCorridor grid cells: no points kept, points checked one by one, all points kept
+OUTSIDE, EDGE, INSIDE = 0, 1, 2
+
+
+@dataclass
+class LidarPoints:
+    """
+    Projected LiDAR point coordinates, kept as plain float64 columns, plus
+    each point's LAS classification code when the source has it.
+    """
+
+    x: np.ndarray
+    y: np.ndarray
+    z: np.ndarray
+    crs_epsg: int = DEFAULT_PROJECTED_EPSG
+    classification: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def ground(self) -> "LidarPoints":
+        """
+        Only the ground-classified points, or all points if none are
+        classified as ground (e.g. unclassified files).
+        """
+        if self.classification is None:
+            return self
+        mask = self.classification == GROUND_CLASS
+        if not mask.any():
+            return self
+        return LidarPoints(
+            self.x[mask], self.y[mask], self.z[mask], self.crs_epsg, self.classification[mask]
+        )
+
+
+def encode_lidar_points(points: LidarPoints) -> bytes:
+    """
+    .npz bytes of the points, e.g. the corridor around a route to cache.
+    Coordinates are kept at full precision. The columns are stored
+    uncompressed, compressing them costs more than reading the LAZ file.
+    """
+    columns = {"x": points.x, "y": points.y, "z": points.z, "crs_epsg": np.int64(points.crs_epsg)}
+    if points.classification is not None:
+        columns["classification"] = points.classification
+    buffer = io.BytesIO()
+    np.savez(buffer, **columns)
+    return buffer.getvalue()
+
+
+def decode_lidar_points(content: bytes) -> LidarPoints:
+    """Read bytes from encode_lidar_points back into LidarPoints."""
+    with np.load(io.BytesIO(content), allow_pickle=False) as columns:
+        return LidarPoints(
+            columns["x"],
+            columns["y"],
+            columns["z"],
+            int(columns["crs_epsg"]),
+            columns["classification"] if "classification" in columns.files else None,
+        )
 
 
 def load_lidar_points(laz_rel_path: str):
@@ -21,12 +97,12 @@ def load_lidar_points(laz_rel_path: str):
 
 def get_route_bounds(gpx_data: GPXData) -> Tuple[float, float, float, float]:
     """Return (min_lat, max_lat, min_lon, max_lon) for the GPX route."""
-    if not gpx_data.latitudes or not gpx_data.longitudes:
+    if len(gpx_data.latitudes) == 0 or len(gpx_data.longitudes) == 0:
         raise ValueError("GPX data has no latitude/longitude points.")
-    min_lat = min(gpx_data.latitudes)
-    max_lat = max(gpx_data.latitudes)
-    min_lon = min(gpx_data.longitudes)
-    max_lon = max(gpx_data.longitudes)
+    min_lat = float(np.min(gpx_data.latitudes))
+    max_lat = float(np.max(gpx_data.latitudes))
+    min_lon = float(np.min(gpx_data.longitudes))
+    max_lon = float(np.max(gpx_data.longitudes))
     return (min_lat, max_lat, min_lon, max_lon)
 
 
@@ -34,7 +110,33 @@ def get_real_path(path: str) -> str:
     return os.path.abspath(os.path.join(os.path.dirname(__file__), path))
 
 
+def get_tiles_path(name: str) -> str:
+    return get_real_path(os.path.join(TILES_ROOT, name))
+
+
+def find_lidar_tiles(directory: str) -> List[str]:
+    """The LAS/LAZ files in a directory of tiles, in name order."""
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(LIDAR_EXTENSIONS)
+    )
+
+
+def list_tile_sets() -> List[str]:
+    """Names of the tile directories under TILES_ROOT that hold any tiles."""
+    root = get_real_path(TILES_ROOT)
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(root)
+        if os.path.isdir(os.path.join(root, name)) and find_lidar_tiles(os.path.join(root, name))
+    )
+
+
 def join_laz_files(p1: str, p2: str, output_name="combined.laz"):
+    # The service reads tiles together without merging them, see read_lidar_tiles_near_route
     p1 = get_real_path(p1)
     p2 = get_real_path(p2)
 
@@ -55,16 +157,22 @@ def join_laz_files(p1: str, p2: str, output_name="combined.laz"):
                     writer.write_points(points)
 
 
-def save_gpx_data_to_laz(gpx_data, output_path: str):
+def save_gpx_data_to_laz(gpx_data, output_path: str, las_crs_epsg: Optional[int] = None):
+    """
+    Write the GPX points as a LAS/LAZ point cloud, projected into las_crs_epsg,
+    by default the MGA/UTM zone of the route.
+    """
     output_path = get_real_path(output_path)
+    if las_crs_epsg is None:
+        las_crs_epsg = route_epsg(gpx_data.latitudes, gpx_data.longitudes)
 
-    # Transformer: WGS84 (EPSG:4326) → GDA94 / MGA Zone 56 (EPSG:28356)
-    transformer = Transformer.from_crs("EPSG:4326", "EPSG:28356", always_xy=True)
+    # Transformer: WGS84 (EPSG:4326) → the projected CRS
+    transformer = get_transformer(4326, las_crs_epsg)
 
     # Transform lon/lat → easting/northing
     eastings, northings = transformer.transform(gpx_data.longitudes, gpx_data.latitudes)
 
-    elevations = np.array([e if e is not None else -9999 for e in gpx_data.elevations])
+    elevations = np.nan_to_num(gpx_data.elevations, nan=-9999)
 
     # Setup LAS header (XYZ only, version 1.4)
     header = laspy.LasHeader(point_format=0, version="1.4")
@@ -75,25 +183,28 @@ def save_gpx_data_to_laz(gpx_data, output_path: str):
     header.y_offset = np.min(northings)
     header.z_offset = np.min(elevations)
 
+    # Add CRS metadata (so GIS knows which projection the points are in)
+    header.add_crs(CRS.from_epsg(las_crs_epsg))
+
     # Create LAS object
     las = laspy.LasData(header)
     las.x = eastings
     las.y = northings
     las.z = elevations
 
-    # Add CRS metadata (so GIS knows it’s EPSG:28356)
-    header.crs = CRS.from_epsg(28356)
-
     # Write file
     las.write(output_path)
 
 
-def fit_lidar_to_route(
-    las, gpx_data: GPXData, margin: float = 0.001, las_crs_epsg: int = 28356
-):
+def get_projected_route_bounds(
+    gpx_data: GPXData, margin: float = 0.001, las_crs_epsg: Optional[int] = None
+) -> Tuple[float, float, float, float]:
     """
-    Filter the LAS points to only those within the bounding box of the GPX route plus a margin.
+    Return (min_x, min_y, max_x, max_y) of the GPX route's bounding box plus a margin (degrees),
+    projected into the LAS CRS, by default the MGA/UTM zone of the route.
     """
+    if las_crs_epsg is None:
+        las_crs_epsg = route_epsg(gpx_data.latitudes, gpx_data.longitudes)
     min_lat, max_lat, min_lon, max_lon = get_route_bounds(gpx_data)
     min_lat -= margin
     max_lat += margin
@@ -101,58 +212,250 @@ def fit_lidar_to_route(
     max_lon += margin
 
     # Transform GPX WGS84 coordinates to LAS CRS
-    transformer = Transformer.from_crs(
-        "EPSG:4326", f"EPSG:{las_crs_epsg}", always_xy=True
-    )
+    transformer = get_transformer(4326, las_crs_epsg)
 
     # Transform the bounding box corners
     (min_x, min_y) = transformer.transform(min_lon, min_lat)
     (max_x, max_y) = transformer.transform(max_lon, max_lat)
+    return (min_x, min_y, max_x, max_y)
 
-    # Create a mask for points within the bounding box
-    mask = (las.x >= min_x) & (las.x <= max_x) & (las.y >= min_y) & (las.y <= max_y)
 
-    # Apply the mask to filter points
-    las.points = las.points[mask]
+def densify_route(x: np.ndarray, y: np.ndarray, spacing: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Subdivide each section of a projected polyline into steps of at most
+    `spacing` meters, so every point on it is within spacing / 2 of a vertex.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(x) < 2:
+        return x, y
 
+    lengths = np.hypot(np.diff(x), np.diff(y))
+    steps = np.maximum(np.ceil(lengths / spacing), 1).astype(np.int64)
+    section = np.repeat(np.arange(len(lengths)), steps)
+    t = (np.arange(section.size) - np.repeat(np.cumsum(steps) - steps, steps)) / np.repeat(steps, steps)
+    dense_x = np.append(x[section] + (x[section + 1] - x[section]) * t, x[-1])
+    dense_y = np.append(y[section] + (y[section + 1] - y[section]) * t, y[-1])
+    return dense_x, dense_y
 
-def create_mini_lidar_file(
-    input_laz_path: str, output_laz_path: str, gpx_data: GPXData, distance: float = 5.0
-):
-    # read the full LIDAR file
-    las = load_lidar_points(input_laz_path)
 
-    # fit LIDAR points to route
-    fit_lidar_to_route(las, gpx_data, margin=0.001, las_crs_epsg=28356)
+class RouteCorridor:
+    """
+    The points within `width` meters of a projected route polyline (plus
+    some up to 1.25 * width, from checking against vertices, not sections).
+
+    Points are first classified with a grid of small cells around the
+    route, one vectorized lookup per point: cells wholly inside the
+    corridor keep all their points, and the points in cells on its edge are
+    checked against a KDTree of the route densified to width / 2 steps. Unlike the
+    route's bounding box, the kept area grows with the trail's length, not
+    with how far it spreads (a loop or a diagonal trail).
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, width: float):
+        self.width = width
+        dense_x, dense_y = densify_route(x, y, width / 2)
+        self.tree = KDTree(np.column_stack((dense_x, dense_y)))
+        reach = 1.25 * width
+        self.bounds = (
+            float(dense_x.min() - reach),
+            float(dense_y.min() - reach),
+            float(dense_x.max() + reach),
+            float(dense_y.max() + reach),
+        )
+
+        # Quarter-width cells, or wider for very long routes so the grid stays small
+        min_x, min_y, max_x, max_y = self.bounds
+        self.cell_size = max(width / 4, np.sqrt((max_x - min_x) * (max_y - min_y) / MAX_CORRIDOR_CELLS))
+        shape = (
+            int((max_x - min_x) // self.cell_size) + 1,
+            int((max_y - min_y) // self.cell_size) + 1,
+        )
+
+        # Kept points are within 1.25 * width of a vertex, so within `cells` cells of the vertex's cell
+        self.grid = np.full(shape, OUTSIDE, dtype=np.uint8)
+        cells = int(np.ceil(reach / self.cell_size))
+        self.grid[self._cells(dense_x, dense_y)] = EDGE
+        self.grid = maximum_filter(self.grid, size=2 * cells + 1, mode="constant")
+
+        # Cells whose every corner is within width of one vertex need no per-point check
+        edge_x, edge_y = np.nonzero(self.grid)
+        centres = np.column_stack(
+            (min_x + (edge_x + 0.5) * self.cell_size, min_y + (edge_y + 0.5) * self.cell_size)
+        )
+        distances, _ = self.tree.query(centres, workers=-1)
+        inside = distances + self.cell_size * np.sqrt(0.5) <= width
+        self.grid[edge_x[inside], edge_y[inside]] = INSIDE
+
+    def _cells(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return (
+            ((x - self.bounds[0]) // self.cell_size).astype(np.int64),
+            ((y - self.bounds[1]) // self.cell_size).astype(np.int64),
+        )
+
+    def mask(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        cell_x, cell_y = self._cells(x, y)
+        within = (cell_x >= 0) & (cell_x < self.grid.shape[0]) & (cell_y >= 0) & (cell_y < self.grid.shape[1])
+        kind = np.full(x.shape, OUTSIDE, dtype=np.uint8)
+        kind[within] = self.grid[cell_x[within], cell_y[within]]
+
+        mask = kind == INSIDE
+        candidates = np.flatnonzero(kind == EDGE)
+        if candidates.size:
+            # Allow for the densified vertices being up to width / 4 off the line
+            distances, _ = self.tree.query(
+                np.column_stack((x[candidates], y[candidates])),
+                distance_upper_bound=self.width * 1.25,
+                workers=-1,
+            )
+            mask[candidates] = np.isfinite(distances)
+        return mask
+
+    def overlaps(self, mins, maxs) -> bool:
+        """True if the box from mins to maxs (e.g. a LAS header's) can hold corridor points."""
+        min_x, min_y, max_x, max_y = self.bounds
+        return maxs[0] >= min_x and mins[0] <= max_x and maxs[1] >= min_y and mins[1] <= max_y
+
+
+def route_corridor(gpx_data: GPXData, las_crs_epsg: int, width: float = CORRIDOR_WIDTH) -> RouteCorridor:
+    transformer = get_transformer(4326, las_crs_epsg)
+    x, y = transformer.transform(gpx_data.longitudes, gpx_data.latitudes)
+    return RouteCorridor(x, y, width)
+
+
+def get_las_crs_epsg(header, gpx_data: GPXData) -> int:
+    """
+    EPSG code of the LAS file's CRS. Files without CRS metadata are assumed
+    to be in the MGA/UTM zone of the route.
+    """
+    crs = header.parse_crs()
+    if crs is not None and crs.to_epsg() is not None:
+        return crs.to_epsg()
+    return route_epsg(gpx_data.latitudes, gpx_data.longitudes)
+
+
+def read_lidar_near_route(
+    laz_file,
+    gpx_data: GPXData,
+    margin: float = 0.001,
+    chunk_size: int = 1_000_000,
+    corridor: Optional[float] = CORRIDOR_WIDTH,
+) -> LidarPoints:
+    """
+    Stream a LAS/LAZ file chunk by chunk, keeping only the points within
+    `corridor` meters of the route. With corridor=None, keep the points inside
+    the route's bounding box plus a margin (degrees) instead. Peak memory is
+    one chunk plus the kept points, rather than the whole file as with laspy.read.
+    """
+    return read_lidar_tiles_near_route([laz_file], gpx_data, margin, chunk_size, corridor)
 
-    # transformer for coordinate conversion
-    transformer_to_projected = Transformer.from_crs(
-        "EPSG:4326", "EPSG:28356", always_xy=True
-    )
 
-    # convert GPX points to projected coordinates (EPSG:28356)
-    gpx_eastings, gpx_northings = transformer_to_projected.transform(
-        gpx_data.longitudes, gpx_data.latitudes
+def _route_filter(gpx_data: GPXData, las_crs_epsg: int, margin: float, corridor: Optional[float]):
+    # (overlaps(mins, maxs), mask(x, y)) for the corridor, or the bounding box when corridor is None
+    if corridor is not None:
+        keep = route_corridor(gpx_data, las_crs_epsg, corridor)
+        return keep.overlaps, keep.mask
+
+    min_x, min_y, max_x, max_y = get_projected_route_bounds(
+        gpx_data, margin=margin, las_crs_epsg=las_crs_epsg
     )
-    gpx_coords = np.vstack((gpx_eastings, gpx_northings)).T
 
-    # create a KDTree for fast nearest-neighbor lookup of GPX points
-    gpx_tree = KDTree(gpx_coords)
+    def overlaps(mins, maxs) -> bool:
+        return maxs[0] >= min_x and mins[0] <= max_x and maxs[1] >= min_y and mins[1] <= max_y
+
+    def mask(x, y) -> np.ndarray:
+        return (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+
+    return overlaps, mask
+
 
-    # vectorized query: query all LiDAR points at once (MUCH faster!)
-    x, y = np.asarray(las.x), np.asarray(las.y)
-    lidar_coords = np.vstack((x, y)).T
-    distances, _ = gpx_tree.query(lidar_coords)
+def read_lidar_tiles_near_route(
+    laz_files: Sequence,
+    gpx_data: GPXData,
+    margin: float = 0.001,
+    chunk_size: int = 1_000_000,
+    corridor: Optional[float] = CORRIDOR_WIDTH,
+) -> LidarPoints:
+    """
+    Same as read_lidar_near_route, for a mosaic of tiles (paths or binary
+    file objects) in one CRS. Each tile's header is read first, and tiles
+    whose bounds miss the corridor are never decompressed. The points kept
+    from every tile are returned together, without writing a merged file.
+    """
+    if not laz_files:
+        raise ValueError("No LiDAR tiles given.")
+
+    xs, ys, zs, classes = [], [], [], []
+    las_crs_epsg = None
 
-    # create boolean mask for points within the distance threshold
-    print(f"Total LIDAR points before filtering: {len(las.x)}")
-    mask = distances <= distance
-    print(f"Number of points within {distance}m of route: {np.sum(mask)}")
+    # Only the coordinates and classification are decompressed (for formats with layered compression)
+    selection = (
+        laspy.DecompressionSelection.XY_RETURNS_CHANNEL
+        | laspy.DecompressionSelection.Z
+        | laspy.DecompressionSelection.CLASSIFICATION
+    )
+    with telemetry.span("lidar_read") as stage:
+        read = 0
+        tiles_read = 0
+        for laz_file in laz_files:
+            # Leave uploaded file objects open for the caller
+            closefd = isinstance(laz_file, (str, os.PathLike))
+            with laspy.open(laz_file, closefd=closefd, decompression_selection=selection) as reader:
+                header = reader.header
+                tile_crs_epsg = get_las_crs_epsg(header, gpx_data)
+                if las_crs_epsg is None:
+                    las_crs_epsg = tile_crs_epsg
+                    overlaps, mask_points = _route_filter(gpx_data, las_crs_epsg, margin, corridor)
+                elif tile_crs_epsg != las_crs_epsg:
+                    raise ValueError(
+                        f"LiDAR tiles must share a CRS, found EPSG:{las_crs_epsg} and EPSG:{tile_crs_epsg}."
+                    )
+
+                # Skip decompression entirely if the tile does not overlap the route
+                if header.point_count == 0 or not overlaps(header.mins, header.maxs):
+                    continue
+                tiles_read += 1
+                for points in reader.chunk_iterator(chunk_size):
+                    x = np.asarray(points.x)
+                    y = np.asarray(points.y)
+                    mask = mask_points(x, y)
+                    xs.append(x[mask])
+                    ys.append(y[mask])
+                    zs.append(np.asarray(points.z)[mask])
+                    classes.append(np.asarray(points.classification, dtype=np.uint8)[mask])
+                    read += len(points)
+        stage.set(points=read, tiles=len(laz_files), tiles_read=tiles_read)
+
+    if not xs:
+        return LidarPoints(
+            np.empty(0), np.empty(0), np.empty(0), las_crs_epsg, np.empty(0, dtype=np.uint8)
+        )
+    return LidarPoints(
+        np.concatenate(xs),
+        np.concatenate(ys),
+        np.concatenate(zs),
+        las_crs_epsg,
+        np.concatenate(classes),
+    )
+
+
+def create_mini_lidar_file(
+    input_laz_path: str, output_laz_path: str, gpx_data: GPXData, distance: float = 5.0
+):
+    """
+    Write the points of a LAS/LAZ file within distance meters of the route to a new LAZ file.
+    The service keeps the same corridor in its cache instead, see pipeline.process_lidar_tiles.
+    """
+    input_path = get_real_path(input_laz_path)
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"LiDAR file not found at the specified path: {input_path}")
 
-    # apply mask to filter points (vectorized operation)
-    filtered_x = np.asarray(las.x)[mask]
-    filtered_y = np.asarray(las.y)[mask]
-    filtered_z = np.asarray(las.z)[mask]
+    points = read_lidar_near_route(input_path, gpx_data, corridor=distance)
+    print(f"Number of points within {distance}m of route: {len(points)}")
+    if len(points) == 0:
+        return
 
     # create new LAS file with filtered points
     output_path = get_real_path(output_laz_path)
@@ -162,28 +465,28 @@ def create_mini_lidar_file(
     header.x_scale = 0.01
     header.y_scale = 0.01
     header.z_scale = 0.01
-    header.x_offset = np.min(filtered_x)
-    header.y_offset = np.min(filtered_y)
-    header.z_offset = np.min(filtered_z)
+    header.x_offset = np.min(points.x)
+    header.y_offset = np.min(points.y)
+    header.z_offset = np.min(points.z)
+
+    # add CRS metadata
+    header.add_crs(CRS.from_epsg(points.crs_epsg))
 
     # create LAS object
     filtered_las = laspy.LasData(header)
-    filtered_las.x = filtered_x
-    filtered_las.y = filtered_y
-    filtered_las.z = filtered_z
-
-    # add CRS metadata
-    header.crs = CRS.from_epsg(28356)
+    filtered_las.x = points.x
+    filtered_las.y = points.y
+    filtered_las.z = points.z
+    if points.classification is not None:
+        filtered_las.classification = points.classification
 
     # write the filtered LAS file
     filtered_las.write(output_path)
-
-    print(f"Filtered {len(filtered_x)} points from {len(las.x)} total points")
     print(f"Saved to {output_path}")
 
     # Max elevation and Min elevation for debugging
-    max_elevation = np.max(filtered_z)
-    min_elevation = np.min(filtered_z)
+    max_elevation = np.max(points.z)
+    min_elevation = np.min(points.z)
     print(f"Max elevation in filtered LIDAR: {max_elevation}")
     print(f"Min elevation in filtered LIDAR: {min_elevation}")
     print(f"Elevation range in filtered LIDAR: {max_elevation - min_elevation}")
@@ -0,0 +1,154 @@
+"""
+Level-of-detail reduction of a trail for drawing.
+
+A chart or map is only ~1000 px wide, so drawing every point of a long
+track is wasted work. These reduce the elevation profile with
+Largest-Triangle-Three-Buckets and the route with Douglas-Peucker in
+projected meters, both of which keep the visible shape.
+"""
+import heapq
+from typing import Dict
+
+import numpy as np
+
+from parseGpx import GPXData, convert_gpx_data_summary, to_json_list
+from projection import get_transformer, route_epsg
+
+
+def _fill_gaps(values: np.ndarray) -> np.ndarray:
+    # Missing elevations are interpolated for choosing points, never returned
+    missing = np.isnan(values)
+    if not missing.any() or missing.all():
+        return np.nan_to_num(values)
+    index = np.arange(values.size)
+    filled = values.copy()
+    filled[missing] = np.interp(index[missing], index[~missing], values[~missing])
+    return filled
+
+
+def lttb(x, y, target: int) -> np.ndarray:
+    """
+    Indices of the target points picked by Largest-Triangle-Three-Buckets.
+    The first and last points are always kept.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = _fill_gaps(np.asarray(y, dtype=np.float64))
+    n = x.size
+    if target >= n or target < 3:
+        return np.arange(n)
+
+    # Points 1..n-2 are split into target - 2 buckets, one point is picked per bucket
+    edges = (np.arange(target - 1) * (n - 2) / (target - 2)).astype(np.int64) + 1
+    edges[-1] = n - 1
+    sizes = np.diff(edges)
+    mean_x = np.add.reduceat(x[: n - 1], edges[:-1]) / sizes
+    mean_y = np.add.reduceat(y[: n - 1], edges[:-1]) / sizes
+    # The bucket after the last one is the final point
+    mean_x = np.append(mean_x[1:], x[-1])
+    mean_y = np.append(mean_y[1:], y[-1])
+
+    picked = np.empty(target, dtype=np.int64)
+    picked[0] = 0
+    picked[-1] = n - 1
+    a = 0
+    for bucket in range(target - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        # Twice the area of the triangle from the last pick through each candidate to the next bucket's mean
+        area = np.abs(
+            (x[a] - mean_x[bucket]) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (mean_y[bucket] - y[a])
+        )
+        a = start + int(np.argmax(area))
+        picked[bucket + 1] = a
+    return picked
+
+
+def _farthest(x: np.ndarray, y: np.ndarray, start: int, end: int):
+    # (distance, index) of the point between start and end farthest from the segment joining them
+    px = x[start + 1:end]
+    py = y[start + 1:end]
+    dx = x[end] - x[start]
+    dy = y[end] - y[start]
+    length_sq = dx * dx + dy * dy
+    if length_sq > 0:
+        t = np.clip(((px - x[start]) * dx + (py - y[start]) * dy) / length_sq, 0.0, 1.0)
+    else:
+        # Closed loops start and end at the same place
+        t = np.zeros(px.size)
+    distance_sq = (px - x[start] - t * dx) ** 2 + (py - y[start] - t * dy) ** 2
+    i = int(np.argmax(distance_sq))
+    return distance_sq[i], start + 1 + i
+
+
+def douglas_peucker(x, y, target: int) -> np.ndarray:
+    """
+    Indices of the target points Douglas-Peucker keeps first, in order along
+    the line. Instead of a tolerance, the segment with the farthest point is
+    always split next, until target points are kept.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = x.size
+    if target >= n or n < 3:
+        return np.arange(n)
+
+    kept = [0, n - 1]
+    heap = []
+
+    def split(start: int, end: int):
+        if end - start >= 2:
+            distance_sq, index = _farthest(x, y, start, end)
+            heapq.heappush(heap, (-distance_sq, start, end, index))
+
+    split(0, n - 1)
+    while heap and len(kept) < target:
+        _, start, end, index = heapq.heappop(heap)
+        kept.append(index)
+        split(start, index)
+        split(index, end)
+    return np.sort(np.array(kept, dtype=np.int64))
+
+
+def decimate_trail(data: GPXData, target: int) -> Dict[str, np.ndarray]:
+    """
+    A reduced profile and route of about target points each.
+
+    The profile also keeps every rolling hill marker point, so markers
+    matched by distance (as the chart does) still land on the line.
+    """
+    latitudes = data.latitudes
+    longitudes = data.longitudes
+    elevations = data.elevations
+    distances_km = data.cumulative_distances_km
+
+    profile = lttb(distances_km, elevations, target)
+    if data.rolling_x is not None and len(data.rolling_x):
+        # rolling_x holds cumulative_distances_m[i] / 1000 of each marker, so this finds i exactly
+        markers = np.searchsorted(distances_km, data.rolling_x)
+        profile = np.union1d(profile, markers[markers < distances_km.size])
+
+    x, y = get_transformer(4326, route_epsg(latitudes, longitudes)).transform(longitudes, latitudes)
+    route = douglas_peucker(x, y, target)
+
+    return {
+        "lod_distances_km": distances_km[profile],
+        "lod_elevations": elevations[profile],
+        "lod_latitudes": latitudes[route],
+        "lod_longitudes": longitudes[route],
+    }
+
+
+def convert_gpx_data_to_lod_json(data: GPXData, lod: Dict[str, np.ndarray]):
+    """
+    Like convert_gpx_data_to_json, but with the per-point arrays replaced by
+    the decimated profile and route from decimate_trail. Turning points and
+    rolling hills are exact.
+    """
+    return {
+        **{name: to_json_list(values) for name, values in lod.items()},
+        **convert_gpx_data_summary(data),
+        "turning_x": to_json_list(data.turning_x),
+        "turning_y": to_json_list(data.turning_y),
+        "rolling_x": to_json_list(data.rolling_x),
+        "rolling_y": to_json_list(data.rolling_y),
+    }
@@ -1,12 +1,42 @@
-from typing import List, Optional
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import FileResponse, JSONResponse
+import asyncio
+import hashlib
+import json as jsonlib
+import os
+import zipfile
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Callable, List, Literal, Optional, Tuple
+from fastapi import FastAPI, File, Form, Header, Query, Request, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
-from parseGpx import GPXData, parse_gpx, convert_gpx_data_to_json, handle_gpx_stats
-from parseLidar import parse_lidar
-from gnss_to_gpx import convert_to_gpx
-from pydantic import BaseModel
+import pipeline
+import telemetry
+from parseGpx import GPXData, convert_gpx_data_to_json, handle_gpx_stats
+from lidar_index import MANIFEST_NAME, get_index_path, list_indexes
+from lidar_util import find_lidar_tiles, get_tiles_path, list_tile_sets
+from parseLidar import corridor_width
+from gnss_to_gpx import iter_gpx, read_gnss_fixes
+from trail_cache import TrailCache
+from trail_format import (
+    TRAIL_COLUMNS_MEDIA_TYPE,
+    TRAIL_NDJSON_MEDIA_TYPE,
+    VERSION as TRAIL_COLUMNS_VERSION,
+    decode_trail_points,
+    encode_trail_columns,
+    encode_trail_points,
+    iter_trail_ndjson,
+    wants_trail_columns,
+    wants_trail_ndjson,
+)
+from result_cache import ResultCache, content_key
+from batch import batch_totals
+from lod import convert_gpx_data_to_lod_json, decimate_trail
+from projection import warm_transformers
+from executor import ExecutorBusy, JobTimeout, PipelineExecutor
+from jobs import JobStore
+from pydantic import BaseModel, Field
 import tempfile
 
 class TrailData(BaseModel):
@@ -16,69 +46,572 @@ class TrailData(BaseModel):
     cumulative_distances_m: List[float]
     threshold: int
     segments: int
+    lod_points: Optional[int] = Field(None, ge=3)
+
+class TrailParams(BaseModel):
+    trail_id: str
+    threshold: int
+    segments: int
+    lod_points: Optional[int] = Field(None, ge=3)
+
+# Optional level of detail for the upload endpoints, see trail_response
+LodPoints = Query(None, ge=3, description="Return a reduced profile and route of about this many points instead of every point")
+
+# LiDAR sampling mode for the LiDAR endpoints, see parseLidar.link_elevations
+SamplingMode = Literal["nearest", "ground"]
+Sampling = Query(pipeline.SAMPLING, description="nearest: the closest LiDAR return, ground: a low percentile of the nearby ground returns")
+
+# LiDAR fusion parameters for the .laz endpoints, see parseLidar.apply_lidar_elevations
+DistanceThresh = Query(pipeline.DISTANCE_THRESH, gt=0, le=100, description="Meters from a GPX point within which LiDAR returns are used")
+MaxTreeGap = Query(pipeline.MAX_TREE_GAP, ge=0, description="Meters above the GPX elevation beyond which a LiDAR return is taken to be a tree")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the shared pyproj transformers before the first request needs them
+    warm_transformers()
+    executor.start()
+    yield
+    executor.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Parsed trails kept server-side so parameter updates only send a trail ID
+trail_cache = TrailCache()
+
+# Responses to repeated uploads, keyed by a hash of the upload and the analysis parameters.
+# Set TRAIL_RESULT_CACHE_DIR to keep them on disk too.
+result_cache = ResultCache(
+    disk_dir=os.environ.get("TRAIL_RESULT_CACHE_DIR") or None,
+    max_disk_bytes=int(os.environ.get("TRAIL_RESULT_CACHE_MB", 1024)) * 1024 * 1024,
+)
+
+# Parsing and LiDAR fusion run here so they don't block the event loop
+executor = PipelineExecutor()
+
+# Background LiDAR jobs, their progress and results
+job_store = JobStore()
+job_tasks = set()
+progress_queue = None
+
+def get_progress_queue():
+    # Created on first use, workers report job stages on it
+    global progress_queue
+    if progress_queue is None:
+        progress_queue = executor.make_queue()
+        job_store.listen(progress_queue)
+    return progress_queue
+
+# Expose the worker pool's load alongside the request and stage metrics
+telemetry.executor_in_flight.read = lambda: executor.in_flight
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Spans of the pipeline stages a request ran, sent back as Server-Timing
+    start = asyncio.get_running_loop().time()
+    with telemetry.trace() as trace:
+        response = await call_next(request)
+    if telemetry.ENABLED:
+        route = request.scope.get("route")
+        telemetry.request_duration.observe(
+            asyncio.get_running_loop().time() - start,
+            method=request.method,
+            route=route.path if route is not None else "unmatched",
+            status=str(response.status_code),
+        )
+        if trace.spans:
+            response.headers["Server-Timing"] = telemetry.server_timing(trace.spans)
+    return response
+
+@app.get("/metrics")
+async def get_metrics():
+    # Prometheus scrape endpoint
+    return PlainTextResponse(telemetry.render_metrics(), media_type=telemetry.PROMETHEUS_CONTENT_TYPE)
+
+@app.exception_handler(ExecutorBusy)
+async def executor_busy_handler(request: Request, exc: ExecutorBusy):
+    return JSONResponse(status_code=503, content={"message": "Server is busy. Please try again shortly."})
+
+@app.exception_handler(JobTimeout)
+async def job_timeout_handler(request: Request, exc: JobTimeout):
+    return JSONResponse(status_code=504, content={"message": "Processing took too long and was abandoned."})
+
+def save_upload(upload: UploadFile, suffix: str) -> Tuple[str, bytes]:
+    # Worker processes can't share the upload object, so hand them a path.
+    # The upload is hashed on the way through, for the result cache.
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+        try:
+            while chunk := upload.file.read(1024 * 1024):
+                digest.update(chunk)
+                tmp.write(chunk)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+        return tmp.name, digest.digest()
+
+def save_uploads(uploads: List[UploadFile], suffix: str) -> Tuple[List[str], bytes]:
+    # Several tiles of one mosaic. A single tile keeps its own digest, so its cache entries still match.
+    saved = []
+    try:
+        for upload in uploads:
+            saved.append(save_upload(upload, suffix))
+    except Exception:
+        # Don't leave the tiles already written behind
+        remove_files([path for path, _ in saved])
+        raise
+    digests = sorted(digest for _, digest in saved)
+    digest = digests[0] if len(digests) == 1 else hashlib.sha256(b"".join(digests)).digest()
+    return [path for path, _ in saved], digest
+
+def tile_set_digest(paths: List[str]) -> bytes:
+    # Registered tiles aren't hashed on every request, their names, sizes and modification times stand in
+    digest = hashlib.sha256()
+    for path in paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.digest()
+
+def read_tile_set(name: str) -> Optional[Tuple[List[str], bytes]]:
+    # The registered set's tile paths and their tile_set_digest, or None if there is no such set
+    if name not in list_tile_sets():
+        return None
+    paths = find_lidar_tiles(get_tiles_path(name))
+    return paths, tile_set_digest(paths)
+
+def read_index_manifest(name: str) -> Optional[Tuple[str, bytes]]:
+    # The index directory and its manifest, or None if there is no such index.
+    # The manifest changes whenever the index is rebuilt.
+    if name not in list_indexes():
+        return None
+    index_dir = get_index_path(name)
+    with open(os.path.join(index_dir, MANIFEST_NAME), "rb") as f:
+        return index_dir, f.read()
 
-app = FastAPI()
+def remove_files(paths: List[str]):
+    for path in paths:
+        os.remove(path)
+
+async def read_upload(upload: UploadFile) -> bytes:
+    with telemetry.span("upload") as stage:
+        contents = await upload.read()
+        stage.set(bytes=len(contents))
+    return contents
+
+def trail_response(gpx_data: GPXData, trail_id: str, accept: Optional[str], lod_points: Optional[int] = None):
+    # Clients that send Accept: application/vnd.trailrunners.columns get the binary format,
+    # and Accept: application/x-ndjson a stream of the summary followed by the arrays in chunks.
+    # With lod_points, the per-point arrays are replaced by a reduced profile and route (see lod.py).
+    lod = None
+    if lod_points is not None:
+        with telemetry.span("decimate", points=len(gpx_data.latitudes)):
+            lod = decimate_trail(gpx_data, lod_points)
+
+    if wants_trail_columns(accept):
+        with telemetry.span("encode_columns") as stage:
+            extra = {"trail_id": trail_id} if lod is None else {"trail_id": trail_id, "lod_points": lod_points}
+            content = encode_trail_columns(gpx_data, lod, **extra)
+            stage.set(bytes=len(content))
+        return Response(status_code=200, content=content, media_type=TRAIL_COLUMNS_MEDIA_TYPE, headers={"Vary": "Accept"})
+
+    if wants_trail_ndjson(accept):
+        extra = {"trail_id": trail_id} if lod is None else {"trail_id": trail_id, "lod_points": lod_points}
+        # Encoded chunk by chunk as it is sent, after the request's trace has ended
+        return StreamingResponse(
+            iter_trail_ndjson(gpx_data, lod, **extra), media_type=TRAIL_NDJSON_MEDIA_TYPE, headers={"Vary": "Accept"}
+        )
+
+    with telemetry.span("encode_json") as stage:
+        if lod is None:
+            json = convert_gpx_data_to_json(gpx_data)
+        else:
+            json = convert_gpx_data_to_lod_json(gpx_data, lod)
+            json["lod_points"] = lod_points
+        json["trail_id"] = trail_id
+        response = JSONResponse(status_code=200, content=json, headers={"Vary": "Accept"})
+        stage.set(bytes=len(response.body))
+    return response
+
+def response_format(accept: Optional[str]) -> str:
+    # The format trail_response picks for an Accept header
+    if wants_trail_columns(accept):
+        return f"columns-v{TRAIL_COLUMNS_VERSION}"
+    if wants_trail_ndjson(accept):
+        return "ndjson"
+    return "json"
+
+def result_key(trail_key: str, accept: Optional[str], lod_points: Optional[int]) -> str:
+    # One entry per response format, for the parameters the upload endpoints use
+    return content_key(
+        trail_key.encode(),
+        format=response_format(accept),
+        threshold=pipeline.THRESHOLD,
+        segments=pipeline.NUM_SPLITS,
+        lod_points=lod_points,
+    )
+
+def points_key(trail_key: str) -> str:
+    return content_key(trail_key.encode(), kind="points")
+
+def cached_response(trail_key: str, accept: Optional[str], lod_points: Optional[int] = None) -> Optional[Response]:
+    """
+    The stored response for an upload seen before, or None. The trail ID
+    is derived from the upload, so the stored payload stays valid as long
+    as the trail can be put back in the trail cache. Streamed NDJSON
+    responses are never stored, so they always miss.
+    """
+    if response_format(accept) == "ndjson":
+        return None
+
+    with telemetry.span("result_cache") as stage:
+        payload = result_cache.get(result_key(trail_key, accept, lod_points))
+        if payload is None:
+            return None
+        stage.set(bytes=len(payload))
+
+    trail_id = trail_key[:32]
+    if trail_id not in trail_cache:
+        points = result_cache.get(points_key(trail_key))
+        if points is None:
+            return None
+        trail_cache.put(decode_trail_points(points), trail_id)
+
+    media_type = TRAIL_COLUMNS_MEDIA_TYPE if wants_trail_columns(accept) else "application/json"
+    return Response(status_code=200, content=payload, media_type=media_type, headers={"Vary": "Accept"})
+
+def store_response(trail_key: str, gpx_data: GPXData, accept: Optional[str], lod_points: Optional[int] = None) -> Response:
+    # Respond and keep the payload, plus the trail's points to restore it to the trail cache
+    trail_id = trail_cache.put(gpx_data, trail_key[:32])
+    response = trail_response(gpx_data, trail_id, accept, lod_points)
+    if not isinstance(response, StreamingResponse):
+        result_cache.put(result_key(trail_key, accept, lod_points), bytes(response.body))
+    result_cache.put(points_key(trail_key), encode_trail_points(gpx_data))
+    return response
+
+def lidar_trail_key(
+    laz_digest: bytes,
+    gpx_bytes: bytes,
+    sampling: str,
+    distance_thresh: float = pipeline.DISTANCE_THRESH,
+    max_tree_gap: float = pipeline.MAX_TREE_GAP,
+) -> str:
+    return content_key(
+        laz_digest,
+        gpx_bytes,
+        kind="lidar",
+        distance_thresh=distance_thresh,
+        max_tree_gap=max_tree_gap,
+        sampling=sampling,
+    )
+
+def corridor_key(laz_digest: bytes, gpx_bytes: bytes, distance_thresh: float) -> str:
+    # The corridor is never narrower than CORRIDOR_WIDTH, so other distance_thresh values share it
+    return content_key(laz_digest, gpx_bytes, kind="corridor", corridor=corridor_width(distance_thresh))
 
 @app.post("/format-gpx")
-async def upload_gpx(file: UploadFile = File(...)):
+async def upload_gpx(file: UploadFile = File(...), accept: Optional[str] = Header(None), lod_points: Optional[int] = LodPoints):
     #check its gpx
     if not file.filename.endswith(".gpx"):
         return JSONResponse(status_code=400, content={"message": "Invalid file type. Please upload a GPX file."})
 
+    gpx_bytes = await read_upload(file)
+    trail_key = content_key(gpx_bytes, kind="gpx")
+    response = await run_in_threadpool(cached_response, trail_key, accept, lod_points)
+    if response is not None:
+        return response
+
     # Process the GPX file
-    gpx_data = parse_gpx(file.file)
-    handle_gpx_stats(gpx_data)
-    json = convert_gpx_data_to_json(gpx_data)
+    gpx_data = await executor.run(pipeline.process_gpx, gpx_bytes)
+
+    return await run_in_threadpool(store_response, trail_key, gpx_data, accept, lod_points)
+
+async def batch_lines(sources: List[Tuple[str, Callable[[], bytes]]], threshold: int, segments: int):
+    # One NDJSON line per file as it finishes, then the totals. At most one file per worker is
+    # read and queued at a time, so a big batch doesn't fill the executor's queue by itself.
+    limit = asyncio.Semaphore(executor.max_workers)
+
+    async def analyse(name: str, read: Callable[[], bytes]) -> dict:
+        async with limit:
+            try:
+                content = await run_in_threadpool(read)
+                return {"name": name, **await executor.run(pipeline.summarise_gpx, content, threshold, segments)}
+            except ExecutorBusy:
+                return {"name": name, "error": "Server is busy. Please try again shortly."}
+            except JobTimeout:
+                return {"name": name, "error": "Processing took too long and was abandoned."}
+            except Exception as e:
+                return {"name": name, "error": str(e)}
+
+    tasks = [asyncio.create_task(analyse(name, read)) for name, read in sources]
+    rows = []
+    try:
+        for task in asyncio.as_completed(tasks):
+            rows.append(await task)
+            yield jsonlib.dumps(rows[-1]) + "\n"
+        yield jsonlib.dumps(batch_totals(rows)) + "\n"
+    finally:
+        # The client went away, don't analyse the rest
+        for task in tasks:
+            task.cancel()
+
+@app.post("/batch")
+async def batch_gpx(files: List[UploadFile] = File(...), threshold: int = Query(pipeline.THRESHOLD), segments: int = Query(pipeline.NUM_SPLITS)):
+    # Headline stats of many .gpx files (uploaded as a list, or in .zip archives) as NDJSON, see batch.py
+    sources = []
+    for upload in files:
+        if upload.filename.endswith(".zip"):
+            try:
+                archive = zipfile.ZipFile(upload.file)
+            except zipfile.BadZipFile:
+                return JSONResponse(status_code=400, content={"message": f"{upload.filename} is not a valid zip file."})
+            sources.extend(
+                (f"{upload.filename}/{name}", partial(archive.read, name))
+                for name in archive.namelist()
+                if name.endswith(".gpx") and not name.startswith("__MACOSX/")
+            )
+        elif upload.filename.endswith(".gpx"):
+            sources.append((upload.filename, upload.file.read))
+        else:
+            return JSONResponse(status_code=400, content={"message": "Invalid file type. Please upload .gpx or .zip files."})
+
+    if not sources:
+        return JSONResponse(status_code=400, content={"message": "No GPX files found in the upload."})
 
-    return JSONResponse(status_code=200, content=json)
+    return StreamingResponse(batch_lines(sources, threshold, segments), media_type="application/x-ndjson")
 
 @app.post("/process-lidar")
-async def process_lidar(lidar_file: UploadFile = File(...), gpx_file: UploadFile = File(...)):
-    if not lidar_file.filename.endswith(".laz"):
+async def process_lidar(lidar_file: List[UploadFile] = File(...), gpx_file: UploadFile = File(...), accept: Optional[str] = Header(None), lod_points: Optional[int] = LodPoints, sampling: SamplingMode = Sampling, distance_thresh: float = DistanceThresh, max_tree_gap: float = MaxTreeGap):
+    # Repeat lidar_file to upload the tiles of a route that crosses tile boundaries
+    if not all(upload.filename.endswith(".laz") for upload in lidar_file):
         return JSONResponse(status_code=400, content={"message": "Invalid LiDAR file type. Please upload a .laz file."})
     
     if not gpx_file.filename.endswith(".gpx"):
         return JSONResponse(status_code=400, content={"message": "Invalid GPX file type. Please upload a .gpx file."})
     
     # Load the lidar data
-    gpx_data = parse_lidar(lidar_file.file, gpx_file.file)
-    handle_gpx_stats(gpx_data)
-    json = convert_gpx_data_to_json(gpx_data)
-    
-    return JSONResponse(status_code=200, content=json)
+    with telemetry.span("save_upload", bytes=sum(upload.size or 0 for upload in lidar_file)):
+        laz_paths, laz_digest = await run_in_threadpool(save_uploads, lidar_file, ".laz")
+    try:
+        gpx_bytes = await read_upload(gpx_file)
+        trail_key = lidar_trail_key(laz_digest, gpx_bytes, sampling, distance_thresh, max_tree_gap)
+        response = await run_in_threadpool(cached_response, trail_key, accept, lod_points)
+        if response is not None:
+            return response
+
+        gpx_data = await executor.run(
+            pipeline.process_lidar_tiles, laz_paths, corridor_key(laz_digest, gpx_bytes, distance_thresh), gpx_bytes,
+            pipeline.THRESHOLD, pipeline.NUM_SPLITS, None, sampling, distance_thresh, max_tree_gap
+        )
+    finally:
+        remove_files(laz_paths)
+
+    return await run_in_threadpool(store_response, trail_key, gpx_data, accept, lod_points)
+
+async def run_lidar_job(job_id: str, laz_paths: List[str], laz_digest: bytes, gpx_bytes: bytes, lod_points: Optional[int] = None, sampling: str = pipeline.SAMPLING, distance_thresh: float = pipeline.DISTANCE_THRESH, max_tree_gap: float = pipeline.MAX_TREE_GAP):
+    progress = pipeline.QueueProgress(get_progress_queue(), job_id)
+    try:
+        # Jobs outlive their request, so they record their stages in a trace of their own
+        with telemetry.trace():
+            trail_key = lidar_trail_key(laz_digest, gpx_bytes, sampling, distance_thresh, max_tree_gap)
+            response = await run_in_threadpool(cached_response, trail_key, None, lod_points)
+            if response is None:
+                gpx_data = await executor.run(
+                    pipeline.process_lidar_tiles, laz_paths, corridor_key(laz_digest, gpx_bytes, distance_thresh), gpx_bytes,
+                    pipeline.THRESHOLD, pipeline.NUM_SPLITS, progress, sampling, distance_thresh, max_tree_gap
+                )
+                response = await run_in_threadpool(store_response, trail_key, gpx_data, None, lod_points)
+        await run_in_threadpool(job_store.finish, job_id, jsonlib.loads(response.body))
+    except ExecutorBusy:
+        await run_in_threadpool(job_store.fail, job_id, "Server is busy. Please try again shortly.")
+    except JobTimeout:
+        await run_in_threadpool(job_store.fail, job_id, "Processing took too long and was abandoned.")
+    except Exception as e:
+        await run_in_threadpool(job_store.fail, job_id, f"Error processing LIDAR data: {e}")
+    finally:
+        remove_files(laz_paths)
+
+@app.post("/jobs/process-lidar")
+async def submit_lidar_job(lidar_file: List[UploadFile] = File(...), gpx_file: UploadFile = File(...), lod_points: Optional[int] = LodPoints, sampling: SamplingMode = Sampling, distance_thresh: float = DistanceThresh, max_tree_gap: float = MaxTreeGap):
+    # Same as /process-lidar, but returns a job ID straight away and runs in the background
+    if not all(upload.filename.endswith(".laz") for upload in lidar_file):
+        return JSONResponse(status_code=400, content={"message": "Invalid LiDAR file type. Please upload a .laz file."})
+
+    if not gpx_file.filename.endswith(".gpx"):
+        return JSONResponse(status_code=400, content={"message": "Invalid GPX file type. Please upload a .gpx file."})
+
+    if executor.full:
+        raise ExecutorBusy()
+
+    laz_paths, laz_digest = await run_in_threadpool(save_uploads, lidar_file, ".laz")
+    job_id = job_store.create()
+    task = asyncio.create_task(run_lidar_job(job_id, laz_paths, laz_digest, await read_upload(gpx_file), lod_points, sampling, distance_thresh, max_tree_gap))
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
+
+    return JSONResponse(status_code=202, content={"job_id": job_id})
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await run_in_threadpool(job_store.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": "Job not found."})
+    return JSONResponse(status_code=200, content=job)
+
+@app.get("/jobs/{job_id}/events")
+async def get_job_events(job_id: str):
+    # Server-sent events: one "progress" event per stage, then "done" or "failed"
+    if await run_in_threadpool(job_store.get, job_id) is None:
+        return JSONResponse(status_code=404, content={"message": "Job not found."})
+
+    async def events():
+        sent = 0
+        while True:
+            job = await run_in_threadpool(job_store.get, job_id)
+            for event in job["events"][sent:]:
+                yield f"event: progress\ndata: {jsonlib.dumps(event)}\n\n"
+            sent = len(job["events"])
+            if job["status"] in ("done", "failed"):
+                data = jsonlib.dumps({"status": job["status"], "error": job["error"]})
+                yield f"event: {job['status']}\ndata: {data}\n\n"
+                return
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = await run_in_threadpool(job_store.get_result, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": "Job not found."})
+    if job["status"] == "failed":
+        return JSONResponse(status_code=500, content={"message": job["error"]})
+    if job["status"] != "done":
+        return JSONResponse(status_code=202, content={"message": "Job is still running.", "stage": job["stage"]})
+    return JSONResponse(status_code=200, content=job["result"])
+
+@app.get("/lidar-indexes")
+async def get_lidar_indexes():
+    return JSONResponse(status_code=200, content=await run_in_threadpool(list_indexes))
+
+@app.post("/process-lidar-index")
+async def process_lidar_index(index_name: str = Form(...), gpx_file: UploadFile = File(...), accept: Optional[str] = Header(None), lod_points: Optional[int] = LodPoints, sampling: SamplingMode = Sampling):
+    # Uses a LiDAR tile index built with lidar_index.py instead of an uploaded .laz
+    index = await run_in_threadpool(read_index_manifest, index_name)
+    if index is None:
+        return JSONResponse(status_code=404, content={"message": f"LiDAR index '{index_name}' not found."})
+
+    if not gpx_file.filename.endswith(".gpx"):
+        return JSONResponse(status_code=400, content={"message": "Invalid GPX file type. Please upload a .gpx file."})
+
+    index_dir, manifest = index
+    gpx_bytes = await read_upload(gpx_file)
+    trail_key = content_key(
+        manifest,
+        gpx_bytes,
+        kind="lidar-index",
+        distance_thresh=pipeline.DISTANCE_THRESH,
+        max_tree_gap=pipeline.MAX_TREE_GAP,
+        sampling=sampling,
+    )
+    response = await run_in_threadpool(cached_response, trail_key, accept, lod_points)
+    if response is not None:
+        return response
+
+    gpx_data = await executor.run(
+        pipeline.process_lidar_index, index_dir, gpx_bytes, pipeline.THRESHOLD, pipeline.NUM_SPLITS, None, sampling
+    )
+
+    return await run_in_threadpool(store_response, trail_key, gpx_data, accept, lod_points)
+
+@app.get("/lidar-tiles")
+async def get_lidar_tile_sets():
+    return JSONResponse(status_code=200, content=await run_in_threadpool(list_tile_sets))
+
+@app.post("/process-lidar-tiles")
+async def process_lidar_tiles(tile_set: str = Form(...), gpx_file: UploadFile = File(...), accept: Optional[str] = Header(None), lod_points: Optional[int] = LodPoints, sampling: SamplingMode = Sampling, distance_thresh: float = DistanceThresh, max_tree_gap: float = MaxTreeGap):
+    # Same as /process-lidar, for a directory of tiles registered under data/lidar/tiles.
+    # Only the tiles whose bounds meet the route corridor are decompressed.
+    tiles = await run_in_threadpool(read_tile_set, tile_set)
+    if tiles is None:
+        return JSONResponse(status_code=404, content={"message": f"LiDAR tile set '{tile_set}' not found."})
+
+    if not gpx_file.filename.endswith(".gpx"):
+        return JSONResponse(status_code=400, content={"message": "Invalid GPX file type. Please upload a .gpx file."})
+
+    tile_paths, tiles_digest = tiles
+    gpx_bytes = await read_upload(gpx_file)
+    trail_key = lidar_trail_key(tiles_digest, gpx_bytes, sampling, distance_thresh, max_tree_gap)
+    response = await run_in_threadpool(cached_response, trail_key, accept, lod_points)
+    if response is not None:
+        return response
+
+    gpx_data = await executor.run(
+        pipeline.process_lidar_tiles, tile_paths, corridor_key(tiles_digest, gpx_bytes, distance_thresh), gpx_bytes,
+        pipeline.THRESHOLD, pipeline.NUM_SPLITS, None, sampling, distance_thresh, max_tree_gap
+    )
+
+    return await run_in_threadpool(store_response, trail_key, gpx_data, accept, lod_points)
 
 @app.post("/convert")
 async def convert_file(file: UploadFile = File(...)):
-    # Save uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as tmp:
-        contents = await file.read()
-        tmp.write(contents)
-        tmp_path = tmp.name
-
-    # Output file
-    output_file = tmp_path.replace(".txt", ".gpx")
-
-    # Run your converter
-    convert_to_gpx(tmp_path, output_file)
-
-    # Return file to frontend
-    return FileResponse(
-        path=output_file,
-        filename="converted_output.gpx",
-        media_type="application/gpx+xml"
+    # Fix rows are parsed straight from the upload and the GPX is streamed back, nothing is written to disk
+    fixes = await run_in_threadpool(read_gnss_fixes, file.file)
+    if len(fixes) == 0:
+        return JSONResponse(status_code=400, content={"message": "No GNSS fixes found in the file."})
+
+    return StreamingResponse(
+        iter_gpx(fixes),
+        media_type="application/gpx+xml",
+        headers={"Content-Disposition": 'attachment; filename="converted_output.gpx"'},
     )
 
-@app.post("/update")
-async def update_params(data: TrailData):
+@app.post("/process-gnss")
+async def process_gnss(file: UploadFile = File(...), accept: Optional[str] = Header(None), lod_points: Optional[int] = LodPoints):
+    # Same as /convert followed by /format-gpx of the result, in one request
+    digest = hashlib.sha256()
+    fixes = await run_in_threadpool(read_gnss_fixes, file.file, 1024 * 1024, digest)
+    if len(fixes) == 0:
+        return JSONResponse(status_code=400, content={"message": "No GNSS fixes found in the file."})
+
+    trail_key = content_key(digest.digest(), kind="gnss")
+    response = await run_in_threadpool(cached_response, trail_key, accept, lod_points)
+    if response is not None:
+        return response
+
+    gpx_data = await executor.run(pipeline.process_gnss, fixes)
+
+    return await run_in_threadpool(store_response, trail_key, gpx_data, accept, lod_points)
+
+def update_response(data: TrailData, accept: Optional[str]) -> Response:
     gpx_data = GPXData(
             longitudes = data.longitudes,
             latitudes = data.latitudes,
             elevations = data.elevations,
             cumulative_distances_m = data.cumulative_distances_m)
+    trail_id = trail_cache.put(gpx_data)
     output = handle_gpx_stats(gpx_data, data.threshold, data.segments)
-    json = convert_gpx_data_to_json(output)
 
-    return JSONResponse(status_code=200, content=json)
+    return trail_response(output, trail_id, accept, data.lod_points)
+
+def update_trail_response(data: TrailParams, accept: Optional[str]) -> Response:
+    gpx_data = trail_cache.get(data.trail_id)
+    analysis = trail_cache.get_analysis(data.trail_id)
+    if gpx_data is None or analysis is None:
+        return JSONResponse(status_code=404, content={"message": "Trail not found or expired. Please resend the trail data to /update."})
+
+    output = handle_gpx_stats(gpx_data, data.threshold, data.segments, analysis)
+
+    return trail_response(output, data.trail_id, accept, data.lod_points)
+
+@app.post("/update")
+async def update_params(data: TrailData, accept: Optional[str] = Header(None)):
+    # The stats, decimation and encoding run off the event loop, like the upload endpoints
+    return await run_in_threadpool(update_response, data, accept)
+
+@app.post("/update-trail")
+async def update_trail_params(data: TrailParams, accept: Optional[str] = Header(None)):
+    # Same as /update, but for a trail already held in the session cache
+    return await run_in_threadpool(update_trail_response, data, accept)
 
 app.add_middleware(
     CORSMiddleware,
@@ -1,62 +1,159 @@
 import os
 import json
+import xml.etree.ElementTree as ET
 
-from dataclasses import dataclass
-from typing import List, Optional
+from array import array
+from typing import List, Optional, Tuple
 
 import gpxpy
-from gpxpy.geo import haversine_distance
+import numpy as np
+from gpxpy.geo import EARTH_RADIUS, haversine_distance
+
+import telemetry
+import trail_analysis
+
+
+def _column(name: str) -> property:
+    # A float64 array attribute, lists (with None for missing values) are converted on assignment
+    slot = "_" + name
+
+    def get(self) -> Optional[np.ndarray]:
+        return getattr(self, slot)
+
+    def set(self, values):
+        setattr(self, slot, None if values is None else np.asarray(values, dtype=np.float64))
+
+    return property(get, set)
 
 
-@dataclass
 class GPXData:
     """Structured GPX parse result.
 
     Attributes
     -----------
-    latitudes: List of latitudes for each point.
-    longitudes: List of longitudes for each point.
-    elevations: List of elevations (meters). 
+    latitudes: Array of latitudes for each point.
+    longitudes: Array of longitudes for each point.
+    elevations: Array of elevations (meters), NaN where missing.
     cumulative_distances_m: Cumulative distances between points in meters.
 
+    The per-point columns and the turning/rolling points are float64 numpy
+    arrays. Lists given to the constructor or assigned later are converted
+    once, arrays are kept as they are (not copied). Convert to lists only
+    when serializing, see convert_gpx_data_to_json.
+
     Convenience
     -----------
     total_distance_m: Total length of the path in meters.
     total_distance_km: Total length of the path in kilometers.
+    cumulative_distances_km: Cumulative distances in kilometers, computed on access.
     """
 
-    latitudes: List[float]
-    longitudes: List[float]
-    elevations: List[Optional[float]]
-    cumulative_distances_m: List[float]
-    altitudeChange: Optional[float] = None
-    altitudeMin: Optional[float] = None
-    altitudeMax: Optional[float] = None
-    altitudeStart: Optional[float] = None
-    altitudeEnd: Optional[float] = None
-    distanceUp: Optional[float] = None
-    distanceDown: Optional[float] = None
-    distanceFlat: Optional[float] = None
-    turning_x: Optional[List[float]] = None
-    turning_y: Optional[List[float]] = None
-    rolling_x: Optional[List[float]] = None
-    rolling_y: Optional[List[float]] = None
-    segment_stats: Optional[List[dict]] = None
-    segment_x_positions: Optional[list[float]] = None
+    __slots__ = (
+        "_latitudes",
+        "_longitudes",
+        "_elevations",
+        "_cumulative_distances_m",
+        "altitudeChange",
+        "altitudeMin",
+        "altitudeMax",
+        "altitudeStart",
+        "altitudeEnd",
+        "distanceUp",
+        "distanceDown",
+        "distanceFlat",
+        "grade",
+        "_turning_x",
+        "_turning_y",
+        "_rolling_x",
+        "_rolling_y",
+        "segment_stats",
+        "segment_x_positions",
+    )
 
+    latitudes = _column("latitudes")
+    longitudes = _column("longitudes")
+    elevations = _column("elevations")
+    cumulative_distances_m = _column("cumulative_distances_m")
+    turning_x = _column("turning_x")
+    turning_y = _column("turning_y")
+    rolling_x = _column("rolling_x")
+    rolling_y = _column("rolling_y")
+
+    def __init__(
+        self,
+        latitudes,
+        longitudes,
+        elevations,
+        cumulative_distances_m,
+        altitudeChange: Optional[float] = None,
+        altitudeMin: Optional[float] = None,
+        altitudeMax: Optional[float] = None,
+        altitudeStart: Optional[float] = None,
+        altitudeEnd: Optional[float] = None,
+        distanceUp: Optional[float] = None,
+        distanceDown: Optional[float] = None,
+        distanceFlat: Optional[float] = None,
+        grade: Optional[float] = None,
+        turning_x=None,
+        turning_y=None,
+        rolling_x=None,
+        rolling_y=None,
+        segment_stats: Optional[List[dict]] = None,
+        segment_x_positions: Optional[List[float]] = None,
+    ):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.elevations = elevations
+        self.cumulative_distances_m = cumulative_distances_m
+        self.altitudeChange = altitudeChange
+        self.altitudeMin = altitudeMin
+        self.altitudeMax = altitudeMax
+        self.altitudeStart = altitudeStart
+        self.altitudeEnd = altitudeEnd
+        self.distanceUp = distanceUp
+        self.distanceDown = distanceDown
+        self.distanceFlat = distanceFlat
+        self.grade = grade
+        self.turning_x = turning_x
+        self.turning_y = turning_y
+        self.rolling_x = rolling_x
+        self.rolling_y = rolling_y
+        self.segment_stats = segment_stats
+        self.segment_x_positions = segment_x_positions
+
+    def __repr__(self) -> str:
+        return f"GPXData(points={len(self.latitudes)}, total_distance_m={self.total_distance_m})"
 
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the point and marker arrays."""
+        columns = (
+            self.latitudes,
+            self.longitudes,
+            self.elevations,
+            self.cumulative_distances_m,
+            self.turning_x,
+            self.turning_y,
+            self.rolling_x,
+            self.rolling_y,
+        )
+        return sum(column.nbytes for column in columns if column is not None)
 
     @property
     def total_distance_m(self) -> float:
-        return self.cumulative_distances_m[-1] if self.cumulative_distances_m else 0.0
+        return float(self.cumulative_distances_m[-1]) if len(self.cumulative_distances_m) else 0.0
 
     @property
     def total_distance_km(self) -> float:
-        return self.cumulative_distances_km[-1] if self.cumulative_distances_km else 0.0
+        return self.total_distance_m / 1000
 
     @property
-    def convert_distance_to_km(self):
-        return [d / 1000 for d in self.cumulative_distances_m]
+    def cumulative_distances_km(self) -> np.ndarray:
+        return self.cumulative_distances_m / 1000
+
+    @property
+    def convert_distance_to_km(self) -> np.ndarray:
+        return self.cumulative_distances_km
 
 
 def get_trail_file_path(trail_name: str) -> str:
@@ -244,11 +341,17 @@ def calculateTrailStats(distances: List[float], elevations: List[float]) -> dict
         "grade" : avgGrade
     }
 
-def handle_gpx_stats(gpx_data: GPXData, threshold = 10, num_splits = 5):
-    stats = calculateTrailStats(gpx_data.cumulative_distances_m, gpx_data.elevations)
-    turning_x, turning_y = calculateTurningPoints(gpx_data.cumulative_distances_m, gpx_data.elevations)
-    rolling_x, rolling_y = calculateDynamic(turning_x, turning_y, threshold, 0.5, 0.04)
-    segment_stats, segment_x_positions = calculateSegments(turning_x, turning_y, num_splits, (gpx_data.cumulative_distances_m[-1] / num_splits), threshold)
+def handle_gpx_stats(gpx_data: GPXData, threshold = 10, num_splits = 5, analysis: Optional[trail_analysis.TrailAnalysis] = None):
+    # Vectorized equivalents of the calculate* functions above.
+    # Pass the trail's cached analysis to skip the threshold/split independent work.
+    with telemetry.span("gpx_stats", points=len(gpx_data.elevations)):
+        if analysis is None:
+            analysis = trail_analysis.TrailAnalysis(gpx_data.cumulative_distances_m, gpx_data.elevations)
+
+        stats = analysis.stats
+        turning_x, turning_y = analysis.turning_x, analysis.turning_y
+        rolling_x, rolling_y = analysis.rolling_hills(threshold)
+        segment_stats, segment_x_positions = analysis.segments.segment_stats(num_splits, (analysis.total_distance / num_splits), threshold)
     
     # assign stats to gpx_data
     gpx_data.altitudeChange = stats["altitudeChange"]
@@ -269,7 +372,158 @@ def handle_gpx_stats(gpx_data: GPXData, threshold = 10, num_splits = 5):
 
     return gpx_data
 
-def parse_gpx(gpx_file) -> GPXData:
+class _PointColumns:
+    """Growable lat/lon/ele columns for one kind of GPX point (track or route)."""
+
+    def __init__(self):
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.elevations = array("d")
+        self.new_segment = True
+        self.missing_first_elevation = False
+
+    def add(self, latitude: float, longitude: float, elevation: Optional[float]):
+        #check elevation points exist
+        if self.new_segment and elevation is None:
+            self.missing_first_elevation = True
+        self.new_segment = False
+
+        self.latitudes.append(latitude)
+        self.longitudes.append(longitude)
+        self.elevations.append(np.nan if elevation is None else elevation)
+
+
+class _GPXPointTarget:
+    """
+    XMLParser target that keeps only trkpt/rtept lat, lon and ele.
+    No element tree is built, everything else in the document is skipped.
+    """
+
+    _segment_tags = {"trkseg": "trkpt", "rte": "rtept"}
+
+    def __init__(self):
+        self.columns = {"trkpt": _PointColumns(), "rtept": _PointColumns()}
+        self._depth = 0
+        self._point = None
+        self._point_depth = 0
+        self._in_ele = False
+        self._ele_text = []
+
+    def start(self, tag, attrib):
+        self._depth += 1
+        name = tag.rpartition("}")[2]
+        if name in self.columns:
+            self._point = (name, float(attrib["lat"]), float(attrib["lon"]))
+            self._point_depth = self._depth
+            self._ele_text = []
+        elif name == "ele" and self._point is not None and self._depth == self._point_depth + 1:
+            self._in_ele = True
+        elif name in self._segment_tags:
+            self.columns[self._segment_tags[name]].new_segment = True
+
+    def data(self, text):
+        if self._in_ele:
+            self._ele_text.append(text)
+
+    def end(self, tag):
+        self._in_ele = False
+        if self._point is not None and self._depth == self._point_depth:
+            name, latitude, longitude = self._point
+            try:
+                elevation = float("".join(self._ele_text))
+            except ValueError:
+                elevation = None
+            self.columns[name].add(latitude, longitude, elevation)
+            self._point = None
+        self._depth -= 1
+
+    def close(self):
+        return self.columns
+
+
+def read_gpx_points(gpx_file, chunk_size: int = 64 * 1024) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Stream the track points (or route points if there are no tracks) out of a GPX file.
+    Returns float64 (latitudes, longitudes, elevations), with NaN for missing elevations.
+
+    The file is fed to the XML parser in chunks and only the coordinate
+    columns are kept, so memory stays at the size of those columns.
+    """
+    parser = ET.XMLParser(target=_GPXPointTarget())
+    while True:
+        chunk = gpx_file.read(chunk_size)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    columns = parser.close()
+
+    # If no track points, get points from routes
+    points = columns["trkpt"] if columns["trkpt"].latitudes else columns["rtept"]
+    if points.missing_first_elevation:
+        raise ValueError("Elevation data is missing for the first point.")
+
+    return (
+        np.frombuffer(points.latitudes, dtype=np.float64),
+        np.frombuffer(points.longitudes, dtype=np.float64),
+        np.frombuffer(points.elevations, dtype=np.float64),
+    )
+
+
+def haversine_distances(latitudes, longitudes) -> np.ndarray:
+    """
+    Vectorized gpxpy.geo.haversine_distance between consecutive points, in meters.
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+
+    d_lon = np.radians(longitudes[:-1] - longitudes[1:])
+    lat1 = np.radians(latitudes[:-1])
+    lat2 = np.radians(latitudes[1:])
+    d_lat = lat1 - lat2
+
+    a = np.sin(d_lat / 2) ** 2 + np.sin(d_lon / 2) ** 2 * np.cos(lat1) * np.cos(lat2)
+    return EARTH_RADIUS * 2 * np.arcsin(np.sqrt(a))
+
+
+def parse_gpx(gpx_file, streaming: bool = True) -> GPXData:
+    """
+    Parse a GPX file into GPXData with elevations standardized to start at 0.
+    By default points are streamed straight into arrays, set streaming=False to parse with gpxpy.
+    """
+    if not streaming:
+        return _parse_gpx_tree(gpx_file)
+
+    with telemetry.span("parse_gpx") as stage:
+        latitudes, longitudes, elevations = read_gpx_points(gpx_file)
+        if latitudes.size == 0:
+            raise ValueError("No valid GPS points found.")
+        stage.set(points=latitudes.size)
+
+        return gpx_data_from_points(latitudes, longitudes, elevations)
+
+
+def gpx_data_from_points(latitudes: np.ndarray, longitudes: np.ndarray, elevations: np.ndarray) -> GPXData:
+    """
+    GPXData for point arrays read from any source, with cumulative distances
+    and elevations standardized to start at 0 as in parse_gpx. The arrays
+    are kept, not copied, and elevations is shifted in place.
+    """
+    #calcuate distance
+    cum_dist_m = np.zeros(latitudes.size)
+    np.cumsum(haversine_distances(latitudes, longitudes), out=cum_dist_m[1:])
+
+    #standardize the elevation to 0
+    elevations -= np.nanmin(elevations)
+
+    return GPXData(
+        latitudes=latitudes,
+        longitudes=longitudes,
+        elevations=elevations,
+        cumulative_distances_m=cum_dist_m,
+    )
+
+
+def _parse_gpx_tree(gpx_file) -> GPXData:
     latitudes: List[float] = []
     longitudes: List[float] = []
     elevations: List[Optional[float]] = []
@@ -321,13 +575,9 @@ def parse_gpx(gpx_file) -> GPXData:
     return gpx_data
 
 
-def convert_gpx_data_to_json(data: GPXData):
+def convert_gpx_data_summary(data: GPXData):
+    """Trail stats without the per-point and turning point arrays."""
     return {
-        "latitudes": data.latitudes,
-        "longitudes": data.longitudes,
-        "elevations": data.elevations,
-        "cumulative_distances_m": data.cumulative_distances_m,
-        "cumulative_distances_km": data.convert_distance_to_km,
         "total_distance_m": data.total_distance_m,
         "total_distance_km": data.total_distance_m / 1000,
 
@@ -342,14 +592,49 @@ def convert_gpx_data_to_json(data: GPXData):
         "distanceDown": data.distanceDown,
         "distanceFlat": data.distanceFlat,
         "grade": data.grade,
-        "turning_x": data.turning_x,
-        "turning_y": data.turning_y,
-        "rolling_x": data.rolling_x,
-        "rolling_y": data.rolling_y,
         "segment_stats": data.segment_stats,
         "segment_x_positions": data.segment_x_positions
     }
 
+def total_gain(elevations: np.ndarray) -> float:
+    """Total climb in meters, the sum of the rises between consecutive known elevations."""
+    known = elevations[~np.isnan(elevations)]
+    return float(np.clip(np.diff(known), 0, None).sum())
+
+def convert_gpx_data_to_row(data: GPXData):
+    """Headline stats of an analysed trail, one row of a batch summary table."""
+    return {
+        "points": len(data.latitudes),
+        "total_distance_km": data.total_distance_m / 1000,
+        "gain_m": total_gain(data.elevations),
+        # rolling_x holds the start and end of each hill
+        "rolling_hills": len(data.rolling_x) // 2,
+        "grade": data.grade,
+    }
+
+def to_json_list(values: Optional[np.ndarray]) -> Optional[list]:
+    """A column as a list for JSON, with NaN (missing elevations) as None."""
+    if values is None:
+        return None
+    items = values.tolist()
+    if np.isnan(values).any():
+        items = [None if value != value else value for value in items]
+    return items
+
+def convert_gpx_data_to_json(data: GPXData):
+    return {
+        "latitudes": to_json_list(data.latitudes),
+        "longitudes": to_json_list(data.longitudes),
+        "elevations": to_json_list(data.elevations),
+        "cumulative_distances_m": to_json_list(data.cumulative_distances_m),
+        "cumulative_distances_km": to_json_list(data.cumulative_distances_km),
+        **convert_gpx_data_summary(data),
+        "turning_x": to_json_list(data.turning_x),
+        "turning_y": to_json_list(data.turning_y),
+        "rolling_x": to_json_list(data.rolling_x),
+        "rolling_y": to_json_list(data.rolling_y),
+    }
+
 def save_json(data: GPXData, file_path: str):
     json_data = convert_gpx_data_to_json(data)
     with open(file_path, 'w') as json_file:
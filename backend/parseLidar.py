@@ -1,139 +1,223 @@
 import numpy as np
-import laspy
-from typing import List, Optional
+from typing import Callable, Optional
 from parseGpx import parse_gpx, GPXData
 from scipy.spatial import KDTree
 from scipy.ndimage import uniform_filter1d
-from pyproj import Transformer
-from lidar_util import get_real_path, fit_lidar_to_route
+from projection import get_transformer
+import telemetry
+from lidar_index import LidarTileIndex
+from lidar_util import CORRIDOR_WIDTH, LidarPoints, get_real_path, read_lidar_near_route
 
 
-def link_points_to_route(
-    las, gpx_data: GPXData, distance_thresh: float
-) -> List[Optional[float]]:
+# Called with the name of each pipeline stage as it starts
+ProgressCallback = Callable[[str], None]
+
+# How each GPX point gets its LiDAR elevation:
+#   nearest  the z of the nearest point within distance_thresh
+#   ground   a low percentile of the z of the ground points within distance_thresh
+SAMPLING_MODES = ("nearest", "ground")
+
+# Ground sampling looks at up to this many points per GPX point
+GROUND_NEIGHBOURS = 16
+# Percentile of their z taken as the ground, 50 for the median
+GROUND_PERCENTILE = 25.0
+
+
+def corridor_width(distance_thresh: float) -> float:
+    """Width of the corridor read around the route, wide enough for every point distance_thresh can link."""
+    return max(CORRIDOR_WIDTH, distance_thresh)
+
+
+def _report(progress: Optional[ProgressCallback], stage: str):
+    if progress is not None:
+        progress(stage)
+
+
+def row_percentile(values: np.ndarray, percentile: float) -> np.ndarray:
     """
-    Link each GPX point to the nearest LIDAR point and return a list of elevations.
-    If no LIDAR points are available, return a list of None.
+    The given percentile of each row of a 2D array, ignoring NaN, with the
+    same linear interpolation as np.percentile. Rows of only NaN give NaN.
+    Sorts once instead of looping over the rows as np.nanpercentile can.
     """
-    if len(las.points) == 0:
+    ordered = np.sort(values, axis=1)  # NaN sorts last
+    count = np.count_nonzero(~np.isnan(ordered), axis=1)
+    position = np.maximum(count - 1, 0) * (percentile / 100.0)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, np.maximum(count - 1, 0))
+    fraction = position - lower
+
+    rows = np.arange(len(ordered))
+    low = ordered[rows, lower]
+    result = low + (ordered[rows, upper] - low) * fraction
+    result[count == 0] = np.nan
+    return result
+
+
+def link_elevations(
+    las: LidarPoints,
+    gpx_data: GPXData,
+    distance_thresh: float,
+    progress: Optional[ProgressCallback] = None,
+    sampling: str = "nearest",
+    percentile: float = GROUND_PERCENTILE,
+) -> np.ndarray:
+    """
+    The LiDAR elevation of each GPX point, normalized so the lowest is 0,
+    with NaN for the points without one. With sampling="nearest" each point
+    takes the z of the nearest LiDAR point within distance_thresh.
+    Reports the "index" (KDTree build) and "link" (query) stages to progress.
+
+    With sampling="ground" only ground-classified points are indexed (when
+    the file has any), and each GPX point gets the given percentile of the
+    z of the up to GROUND_NEIGHBOURS points within distance_thresh, so one
+    stray return (a branch, a bird, a low outlier) can't set its elevation.
+    """
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"Unknown LiDAR sampling mode: {sampling}")
+    if sampling == "ground":
+        las = las.ground()
+
+    if len(las.x) == 0:
         print("No LIDAR points available after filtering.")
-        return [None] * len(gpx_data.latitudes)
-
-    # Transform GPX WGS84 coordinates to LAS CRS
-    transformer = Transformer.from_crs("EPSG:4326", "EPSG:28356", always_xy=True)
-
-    # create a KDTree for fast nearest-neighbor lookup
-    lidar_coords = np.vstack((las.x, las.y)).T
-    tree = KDTree(lidar_coords)
-    elevations: List[Optional[float]] = []
-    for lat, lon in zip(gpx_data.latitudes, gpx_data.longitudes):
-        x, y = transformer.transform(lon, lat)
-        distance, index = tree.query((x, y))
-        if distance < distance_thresh:  # threshold distance in meters
-            elevations.append(float(las.z[int(index)]))
+        return np.full(len(gpx_data.latitudes), np.nan)
+
+    # Transform all GPX WGS84 coordinates to LAS CRS in one call
+    transformer = get_transformer(4326, las.crs_epsg)
+    x, y = transformer.transform(gpx_data.longitudes, gpx_data.latitudes)
+
+    # create a KDTree and query every GPX point at once, across all cores
+    _report(progress, "index")
+    with telemetry.span("kdtree_build", points=len(las.x)):
+        lidar_coords = np.column_stack((las.x, las.y))
+        tree = KDTree(lidar_coords)
+    _report(progress, "link")
+    with telemetry.span("kdtree_query", points=len(x)) as stage:
+        if sampling == "ground":
+            # Neighbours beyond the threshold come back with index len(las.x)
+            _, indices = tree.query(
+                np.column_stack((x, y)),
+                k=GROUND_NEIGHBOURS,
+                distance_upper_bound=distance_thresh,
+                workers=-1,
+            )
+            neighbour_z = np.append(np.asarray(las.z, dtype=float), np.nan)[indices]
+            lidar_z = row_percentile(neighbour_z, percentile)
         else:
-            elevations.append(None)  # no nearby LIDAR point
+            # threshold distance in meters, points without a nearby LIDAR point get NaN
+            distances, indices = tree.query(np.column_stack((x, y)), workers=-1)
+            lidar_z = np.where(distances < distance_thresh, np.asarray(las.z)[indices], np.nan)
+        # GPX points with a LiDAR elevation, 0 when none is within distance_thresh
+        found = ~np.isnan(lidar_z)
+        stage.set(linked=int(found.sum()))
 
-    # Normalize elevations to start at 0
-    min_elevation = min(e for e in elevations if e is not None)
-    elevations = [e - min_elevation if e is not None else None for e in elevations]
+    if not found.any():
+        return lidar_z
 
-    return elevations
+    # Normalize elevations to start at 0
+    return lidar_z - lidar_z[found].min()
 
 
-def fuse_elevation_models(
-    lidar_elevations: List[float | None],
-    gpx_elevations: List[float | None],
+def fuse_elevations(
+    lidar: np.ndarray,
+    gpx: np.ndarray,
     max_gap: float = 3.0,
     weight_lidar: float = 0.7,
     smoothing_window: int = 5,
-) -> None | List[float]:
+) -> np.ndarray:
     """
-    Prune LIDAR elevations that are likely to be from trees.
-    If a gap larger than max_gap is detected between consecutive known elevations,
-    the elevations in that gap are set to None.
+    Fuse LiDAR and GPX elevations (float arrays, NaN where missing) into one profile.
+    A LiDAR elevation more than max_gap above the GPX one is likely a tree and
+    is replaced by the GPX one, then the two are blended with weight_lidar and
+    smoothed with a moving average of smoothing_window points. Where either
+    is missing, the other is used as is.
     """
+    both = ~np.isnan(lidar) & ~np.isnan(gpx)
 
-    if len(lidar_elevations) != len(gpx_elevations):
-        raise ValueError("Arrays must be the same length.")
-
-    fused = []
-    for lidar, gpx in zip(lidar_elevations, gpx_elevations):
-        # Skip None values
-        if lidar is None or gpx is None:
-            fused.append(gpx if gpx is not None else lidar)
-            continue
+    # Prune spikes above GPX
+    lidar = np.where(both & (lidar - gpx > max_gap), gpx, lidar)
 
-        # Prune spikes above GPX
-        if lidar - gpx > max_gap:
-            lidar = gpx
-
-        # Weighted fusion
-        fused_val = weight_lidar * lidar + (1 - weight_lidar) * gpx
-        fused.append(fused_val)
+    # Weighted fusion where both are known, otherwise whichever one is
+    fused = np.where(np.isnan(gpx), lidar, gpx)
+    fused[both] = weight_lidar * lidar[both] + (1 - weight_lidar) * gpx[both]
 
     # Smooth the array using a simple moving average
-    fused_array = np.array(fused, dtype=float)
-    smoothed = uniform_filter1d(fused_array, size=smoothing_window, mode="nearest")
-
-    return smoothed.tolist()
+    return uniform_filter1d(fused, size=smoothing_window, mode="nearest")
 
 
-def fill_missing_values(elevations: List[Optional[float]]) -> List[float | None]:
-    n = len(elevations)
-    result = elevations.copy()
+def apply_lidar_elevations(
+    las,
+    gpx_data: GPXData,
+    distance_thresh: float = 1.5,
+    max_tree_gap: float = 1.5,
+    progress: Optional[ProgressCallback] = None,
+    sampling: str = "nearest",
+) -> GPXData:
+    """
+    Link the route to the given LiDAR points and fuse the result into gpx_data.elevations.
+    """
+    lidar_elevations = link_elevations(
+        las, gpx_data, distance_thresh=distance_thresh, progress=progress, sampling=sampling
+    )
 
-    # Forward pass: fill with last known value
-    last_val = None
-    for i in range(n):
-        if result[i] is not None:
-            last_val = result[i]
-        else:
-            result[i] = last_val
-
-    # Backward pass: fill remaining None with next known value
-    next_val = None
-    for i in range(n - 1, -1, -1):
-        if result[i] is not None:
-            next_val = result[i]
-        elif next_val is not None:
-            # Linear interpolation
-            # Find the start of the missing segment
-            j = i
-            while j >= 0 and elevations[j] is None:
-                j -= 1
-            start_val = result[j] if j >= 0 else next_val
-            end_val = next_val
-            segment_len = i - j
-            for k in range(j + 1, i + 1):
-                ratio = (k - j) / segment_len
-                if (start_val is not None) and (end_val is not None):
-                    result[k] = start_val + (end_val - start_val) * ratio
-                else:
-                    result[k] = start_val if start_val is not None else end_val
+    _report(progress, "fuse")
+    with telemetry.span("fuse", points=len(lidar_elevations)):
+        fusion = fuse_elevations(
+            lidar_elevations, gpx_data.elevations, max_gap=max_tree_gap
+        )
+    gpx_data.elevations = fusion
 
-    return result
+    return gpx_data
 
 
 def parse_lidar(
-    laz_file, gpx_file, distance_thresh: float = 1.5, max_tree_gap: float = 1.5
+    laz_file,
+    gpx_file,
+    distance_thresh: float = 1.5,
+    max_tree_gap: float = 1.5,
+    progress: Optional[ProgressCallback] = None,
+    sampling: str = "nearest",
 ) -> GPXData:
+    """
+    Replace the GPX elevations with ones fused from the LiDAR file.
+    Stages reported to progress: read, crop, index, link, fuse.
+    See link_elevations for the sampling modes.
+    """
+    _report(progress, "read")
     gpx_data = parse_gpx(gpx_file)
 
-    las = laspy.read(laz_file)
-    fit_lidar_to_route(las, gpx_data, margin=0.001, las_crs_epsg=28356)
+    # Stream only the points around the route instead of reading the whole file
+    _report(progress, "crop")
+    las = read_lidar_near_route(laz_file, gpx_data, corridor=corridor_width(distance_thresh))
 
-    lidar_elevations = link_points_to_route(
-        las, gpx_data, distance_thresh=distance_thresh
+    return apply_lidar_elevations(
+        las, gpx_data, distance_thresh, max_tree_gap, progress=progress, sampling=sampling
     )
 
-    fusion = fuse_elevation_models(
-        lidar_elevations, gpx_data.elevations, max_gap=max_tree_gap
-    )
-    if fusion is not None:
-        gpx_data.elevations = [float(e) for e in fusion]
 
-    return gpx_data
+def parse_lidar_index(
+    index_dir: str,
+    gpx_file,
+    distance_thresh: float = 1.5,
+    max_tree_gap: float = 1.5,
+    progress: Optional[ProgressCallback] = None,
+    sampling: str = "nearest",
+) -> GPXData:
+    """
+    Same as parse_lidar, but reads only the cells of a tile index (see lidar_index.py)
+    that the route passes through, instead of decompressing a LAZ file.
+    """
+    _report(progress, "read")
+    gpx_data = parse_gpx(gpx_file)
+
+    _report(progress, "crop")
+    index = LidarTileIndex(index_dir)
+    with telemetry.span("lidar_index_read") as stage:
+        las = index.read_route(gpx_data, buffer=corridor_width(distance_thresh))
+        stage.set(points=len(las))
+
+    return apply_lidar_elevations(
+        las, gpx_data, distance_thresh, max_tree_gap, progress=progress, sampling=sampling
+    )
 
 
 if __name__ == "__main__":
@@ -150,7 +234,7 @@ if __name__ == "__main__":
     # plot the elevations against distance
     import matplotlib.pyplot as plt
 
-    fixed_eles = [e if e is not None else 0 for e in result.elevations]
+    fixed_eles = np.nan_to_num(result.elevations)
     plt.plot(result.cumulative_distances_m, fixed_eles)
     plt.xlabel("Distance (m)")
     plt.ylabel("Elevation (m)")
@@ -0,0 +1,142 @@
+"""
+Top-level pipeline tasks run by the executor (see executor.py).
+
+They take plain bytes and paths rather than upload objects, so they can be
+sent to a worker process.
+"""
+import io
+import os
+import tempfile
+import time
+from typing import List, Optional
+
+from gnss_to_gpx import GnssFixes, gnss_to_gpx_data
+from parseGpx import GPXData, convert_gpx_data_to_row, parse_gpx, handle_gpx_stats
+from lidar_util import decode_lidar_points, encode_lidar_points, read_lidar_tiles_near_route
+from parseLidar import ProgressCallback, apply_lidar_elevations, corridor_width, parse_lidar_index
+from result_cache import ResultCache
+import telemetry
+
+# Analysis and LiDAR fusion parameters used by the endpoints, part of the result cache key
+THRESHOLD = 10
+NUM_SPLITS = 5
+DISTANCE_THRESH = 1.5
+MAX_TREE_GAP = 1.5
+# LiDAR sampling mode when a request doesn't choose one, see parseLidar.link_elevations
+SAMPLING = "nearest"
+
+# LiDAR points around each route, see process_lidar_tiles. Kept on disk so every worker process
+# can use the corridors the others cropped, and so they survive restarts.
+CORRIDOR_CACHE_DIR = os.environ.get("TRAIL_CORRIDOR_CACHE_DIR") or os.path.join(
+    tempfile.gettempdir(), "trailrunners-corridors"
+)
+_corridor_cache = None
+
+
+class QueueProgress:
+    """
+    Progress callback that posts (job_id, stage, timestamp) to a queue.
+    Picklable when the queue is (e.g. a multiprocessing Manager queue),
+    so it can report from a worker process.
+    """
+
+    def __init__(self, queue, job_id: str):
+        self.queue = queue
+        self.job_id = job_id
+
+    def __call__(self, stage: str):
+        self.queue.put((self.job_id, stage, time.time()))
+
+
+def process_gpx(gpx_bytes: bytes, threshold: int = THRESHOLD, num_splits: int = NUM_SPLITS) -> GPXData:
+    gpx_data = parse_gpx(io.BytesIO(gpx_bytes))
+    return handle_gpx_stats(gpx_data, threshold, num_splits)
+
+
+def summarise_gpx(gpx_bytes: bytes, threshold: int = THRESHOLD, num_splits: int = NUM_SPLITS) -> dict:
+    # For batches, only the headline stats go back to the caller, not the point arrays
+    return convert_gpx_data_to_row(process_gpx(gpx_bytes, threshold, num_splits))
+
+
+def process_gnss(fixes: GnssFixes, threshold: int = THRESHOLD, num_splits: int = NUM_SPLITS) -> GPXData:
+    gpx_data = gnss_to_gpx_data(fixes)
+    return handle_gpx_stats(gpx_data, threshold, num_splits)
+
+
+def get_corridor_cache() -> ResultCache:
+    # One per process, the workers share entries through CORRIDOR_CACHE_DIR
+    global _corridor_cache
+    if _corridor_cache is None:
+        _corridor_cache = ResultCache(
+            max_bytes=int(os.environ.get("TRAIL_CORRIDOR_CACHE_MEMORY_MB", 64)) * 1024 * 1024,
+            disk_dir=CORRIDOR_CACHE_DIR,
+            max_disk_bytes=int(os.environ.get("TRAIL_CORRIDOR_CACHE_MB", 1024)) * 1024 * 1024,
+        )
+    return _corridor_cache
+
+
+def process_lidar_tiles(
+    laz_paths: List[str],
+    corridor_key: str,
+    gpx_bytes: bytes,
+    threshold: int = THRESHOLD,
+    num_splits: int = NUM_SPLITS,
+    progress: Optional[ProgressCallback] = None,
+    sampling: str = SAMPLING,
+    distance_thresh: float = DISTANCE_THRESH,
+    max_tree_gap: float = MAX_TREE_GAP,
+) -> GPXData:
+    """
+    Replace the GPX elevations with ones fused from one or more LiDAR tiles
+    and analyse the trail, through the corridor cache. The points within
+    parseLidar.corridor_width(distance_thresh) of the route are cropped from
+    the tiles and cached under corridor_key the first time, and read back
+    from the cache after that without opening the tiles. The key must
+    identify the tiles, the GPX and the corridor width.
+    Stages reported to progress: read, crop, index, link, fuse, stats.
+    """
+    if progress is not None:
+        progress("read")
+    gpx_data = parse_gpx(io.BytesIO(gpx_bytes))
+
+    if progress is not None:
+        progress("crop")
+    cache = get_corridor_cache()
+    with telemetry.span("corridor_cache") as stage:
+        content = cache.get(corridor_key)
+        stage.set(bytes=len(content) if content is not None else 0)
+    if content is not None:
+        las = decode_lidar_points(content)
+    else:
+        las = read_lidar_tiles_near_route(
+            laz_paths, gpx_data, corridor=corridor_width(distance_thresh)
+        )
+        cache.put(corridor_key, encode_lidar_points(las))
+
+    gpx_data = apply_lidar_elevations(
+        las, gpx_data, distance_thresh, max_tree_gap, progress=progress, sampling=sampling
+    )
+    if progress is not None:
+        progress("stats")
+    return handle_gpx_stats(gpx_data, threshold, num_splits)
+
+
+def process_lidar_index(
+    index_dir: str,
+    gpx_bytes: bytes,
+    threshold: int = THRESHOLD,
+    num_splits: int = NUM_SPLITS,
+    progress: Optional[ProgressCallback] = None,
+    sampling: str = SAMPLING,
+) -> GPXData:
+    gpx_data = parse_lidar_index(
+        index_dir,
+        io.BytesIO(gpx_bytes),
+        DISTANCE_THRESH,
+        MAX_TREE_GAP,
+        progress=progress,
+        sampling=sampling,
+    )
+    if progress is not None:
+        progress("stats")
+    return handle_gpx_stats(gpx_data, threshold, num_splits)
@@ -0,0 +1,55 @@
+import threading
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+from pyproj import Transformer
+
+WGS84_EPSG = 4326
+# GDA94 / MGA zone 56, the zone our Brisbane survey tiles are in
+DEFAULT_PROJECTED_EPSG = 28356
+
+_transformers: Dict[Tuple[int, int], Transformer] = {}
+_lock = threading.Lock()
+
+
+def get_transformer(src_epsg: int = WGS84_EPSG, dst_epsg: int = DEFAULT_PROJECTED_EPSG) -> Transformer:
+    """
+    Return a shared always_xy Transformer between two EPSG codes.
+
+    Building a Transformer loads PROJ database state, so each (src, dst) pair
+    is built once per process. pyproj Transformers are thread-safe (>= 3.1),
+    so the same instance can be used from any thread.
+    """
+    key = (int(src_epsg), int(dst_epsg))
+    transformer = _transformers.get(key)
+    if transformer is None:
+        with _lock:
+            transformer = _transformers.get(key)
+            if transformer is None:
+                transformer = Transformer.from_crs(
+                    f"EPSG:{key[0]}", f"EPSG:{key[1]}", always_xy=True
+                )
+                _transformers[key] = transformer
+    return transformer
+
+
+def warm_transformers(pairs: Iterable[Tuple[int, int]] = ((WGS84_EPSG, DEFAULT_PROJECTED_EPSG),)):
+    """Build the given transformers up front, e.g. at app startup."""
+    for src_epsg, dst_epsg in pairs:
+        get_transformer(src_epsg, dst_epsg).transform(0.0, 0.0)
+
+
+def projected_epsg_for(latitude: float, longitude: float) -> int:
+    """
+    Return the projected CRS for a WGS84 location: GDA94 / MGA zones inside
+    Australia, otherwise WGS84 / UTM north or south.
+    """
+    zone = int((longitude + 180) // 6) % 60 + 1
+    if -45 <= latitude <= -9 and 108 <= longitude <= 156:
+        return 28300 + zone
+    return (32600 if latitude >= 0 else 32700) + zone
+
+
+def route_epsg(latitudes, longitudes) -> int:
+    """Projected CRS for a route, chosen from its centroid."""
+    return projected_epsg_for(float(np.mean(latitudes)), float(np.mean(longitudes)))
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+# Bump when a change to parsing or analysis changes results, so old entries are never served
+CACHE_VERSION = 1
+
+
+def content_key(*contents: bytes, **params) -> str:
+    """
+    Hash uploaded contents (or digests of them) and the parameters that
+    affect the result into a cache key.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}".encode())
+    for content in contents:
+        # Length-prefixed so (b"ab", b"c") and (b"a", b"bc") differ
+        digest.update(len(content).to_bytes(8, "little"))
+        digest.update(content)
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Content-addressed cache of serialized results, keyed by content_key.
+
+    Entries live in an in-memory LRU bounded by max_entries and max_bytes.
+    If disk_dir is set, every entry is also written there, and the least
+    recently used files are deleted once they add up to more than
+    max_disk_bytes. Memory misses fall back to disk, so results survive
+    restarts and memory evictions.
+
+    The size of the directory is scanned once and then kept as a running
+    total of this cache's writes, so a write only rescans the directory
+    when the total goes over the limit. Several processes may share a
+    directory: each counts its own writes, the rescan picks up the others',
+    and files another process removes first are skipped.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: int = 128 * 1024 * 1024,
+        disk_dir: Optional[str] = None,
+        max_disk_bytes: int = 1024 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._nbytes = 0
+        self._disk_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                return value
+
+        value = self._read_disk(key)
+        if value is not None:
+            self._put_memory(key, value)
+        return value
+
+    def put(self, key: str, value: bytes):
+        self._put_memory(key, value)
+        self._write_disk(key, value)
+
+    def _put_memory(self, key: str, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._nbytes -= len(previous)
+            self._entries[key] = value
+            self._nbytes += len(value)
+            while len(self._entries) > self.max_entries or self._nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._nbytes -= len(evicted)
+
+    def _path(self, key: str) -> Optional[str]:
+        # Keys are sha256 hex digests, anything else can't be a file of ours
+        if self.disk_dir is None or len(key) != 64 or not all(c in "0123456789abcdef" for c in key):
+            return None
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            # Mark as recently used for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return value
+
+    def _write_disk(self, key: str, value: bytes):
+        path = self._path(key)
+        if path is None or len(value) > self.max_disk_bytes:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        # Unique per process and thread, several workers can share the directory
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                # First write, the scan already includes this file
+                self._disk_bytes = sum(size for _, size, _ in self._scan_disk())
+            else:
+                self._disk_bytes += len(value) - replaced
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _scan_disk(self) -> List[Tuple[str, int, float]]:
+        # (path, size, mtime) of every entry, skipping files removed while scanning
+        files = []
+        for shard in os.scandir(self.disk_dir):
+            if not shard.is_dir():
+                continue
+            try:
+                entries = list(os.scandir(shard.path))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _evict_disk(self):
+        # Called with _disk_lock held. Rescans, as other processes may have written or evicted too.
+        files = self._scan_disk()
+        total = sum(size for _, size, _ in files)
+        for path, size, _ in sorted(files, key=lambda item: item[2]):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self._disk_bytes = total
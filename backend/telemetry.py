@@ -0,0 +1,265 @@
+"""
+Lightweight tracing and metrics for the pipeline.
+
+Code wraps each stage in a span:
+
+    with telemetry.span("kdtree_build", points=len(las)):
+        tree = KDTree(coords)
+
+Spans are only recorded inside a trace, which the HTTP middleware in
+main.py opens per request (and run_lidar_job per background job). Outside
+a trace, or with TRAIL_TELEMETRY=0, span() returns a shared no-op, so the
+stages cost one context variable lookup when nothing is listening.
+
+When a trace ends its spans feed the Prometheus metrics served by
+/metrics, and the request's spans are sent back as a Server-Timing header.
+Worker processes can't see the request's trace, so the executor runs jobs
+through run_traced and merges the spans they return.
+"""
+import math
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+ENABLED = os.environ.get("TRAIL_TELEMETRY", "1") != "0"
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from sub-millisecond stats up to LiDAR fusion of large tiles
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# (name, duration in seconds, attributes) of each finished span
+SpanRecord = Tuple[str, float, Dict[str, float]]
+
+_trace: ContextVar[Optional[List[SpanRecord]]] = ContextVar("trail_trace", default=None)
+
+
+class _Span:
+    __slots__ = ("spans", "name", "attrs", "start")
+
+    def __init__(self, spans: List[SpanRecord], name: str, attrs: Dict[str, float]):
+        self.spans = spans
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs):
+        """Add attributes once they are known, e.g. the number of points kept."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.spans.append((self.name, time.perf_counter() - self.start, self.attrs))
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """
+    Time a stage of the current trace. The attributes "points" and "bytes"
+    are added to the points and bytes processed counters.
+    """
+    spans = _trace.get()
+    if spans is None:
+        return _NOOP_SPAN
+    return _Span(spans, name, attrs)
+
+
+def tracing() -> bool:
+    return _trace.get() is not None
+
+
+def add_spans(spans: List[SpanRecord]):
+    """Add spans recorded elsewhere, e.g. in a worker process, to the current trace."""
+    current = _trace.get()
+    if current is not None:
+        current.extend(spans)
+
+
+class trace:
+    """
+    Collect the spans of one request or job. On exit they are recorded in
+    the metrics. The spans are available as .spans, e.g. for Server-Timing.
+    """
+
+    def __init__(self):
+        self.spans: List[SpanRecord] = []
+        self._token = None
+
+    def __enter__(self):
+        if ENABLED:
+            self._token = _trace.set(self.spans)
+        return self
+
+    def __exit__(self, *exc):
+        if self._token is not None:
+            _trace.reset(self._token)
+            record_spans(self.spans)
+        return False
+
+
+def run_traced(fn: Callable, *args):
+    """Run fn(*args) in a new trace and return (result, spans). Picklable for worker processes."""
+    spans: List[SpanRecord] = []
+    token = _trace.set(spans)
+    try:
+        return fn(*args), spans
+    finally:
+        _trace.reset(token)
+
+
+def server_timing(spans: List[SpanRecord]) -> str:
+    """Format spans as a Server-Timing header value, durations in milliseconds."""
+    return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration, _ in spans)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """A gauge read from a callback when metrics are rendered."""
+
+    def __init__(self, name: str, help: str, read: Callable[[], float] = lambda: 0.0):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {_format_value(self.read())}",
+        ]
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            values = self._values.get(key)
+            if values is None:
+                values = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += value
+            values[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._values.items())
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(bucket_labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {values[-1]}")
+        return lines
+
+
+request_duration = Histogram(
+    "trail_request_duration_seconds", "Time to handle an HTTP request.", ("method", "route", "status")
+)
+stage_duration = Histogram(
+    "trail_stage_duration_seconds", "Time spent in each pipeline stage.", ("stage",)
+)
+points_processed = Counter(
+    "trail_points_processed_total", "GPX or LiDAR points handled by each pipeline stage.", ("stage",)
+)
+bytes_processed = Counter(
+    "trail_bytes_processed_total", "Bytes read or written by each pipeline stage.", ("stage",)
+)
+executor_in_flight = Gauge("trail_executor_in_flight", "Jobs running or queued on the worker pool.")
+
+METRICS = [request_duration, stage_duration, points_processed, bytes_processed, executor_in_flight]
+
+
+def record_spans(spans: List[SpanRecord]):
+    for name, duration, attrs in spans:
+        stage_duration.observe(duration, stage=name)
+        if "points" in attrs:
+            points_processed.inc(attrs["points"], stage=name)
+        if "bytes" in attrs:
+            bytes_processed.inc(attrs["bytes"], stage=name)
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
@@ -0,0 +1,12 @@
+import glob
+import os
+import sys
+
+# The backend modules are imported as top-level modules, as uvicorn main:app does
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# Every bundled trail, backend fixtures first
+GPX_FIXTURES = sorted(glob.glob(os.path.join(BACKEND_DIR, "data", "gpx", "*.gpx"))) + sorted(
+    glob.glob(os.path.join(BACKEND_DIR, "..", "trailrunners", "trails", "*.gpx"))
+)
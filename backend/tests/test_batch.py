@@ -0,0 +1,51 @@
+"""Batch rows (see batch.py) against the full analysis of the same file."""
+import math
+import os
+
+import pytest
+
+import pipeline
+from batch import batch_totals, format_table
+from conftest import GPX_FIXTURES
+from parseGpx import calculateDynamic, calculateTurningPoints, convert_gpx_data_to_json
+from trail_analysis import STRIDE_LENGTH, VERTICAL_OSCILLATION
+
+
+@pytest.mark.parametrize("path", GPX_FIXTURES, ids=os.path.basename)
+def test_row_matches_format_gpx(path):
+    with open(path, "rb") as f:
+        gpx_bytes = f.read()
+    try:
+        upload = convert_gpx_data_to_json(pipeline.process_gpx(gpx_bytes))
+    except ValueError as e:
+        pytest.skip(str(e))
+
+    # Hills and climb counted the long way, from the /format-gpx response
+    known = [e for e in upload["elevations"] if e is not None]
+    turning_x, turning_y = calculateTurningPoints(upload["cumulative_distances_m"], upload["elevations"])
+    rolling_x, _ = calculateDynamic(turning_x, turning_y, pipeline.THRESHOLD, STRIDE_LENGTH, VERTICAL_OSCILLATION)
+    expected = {
+        "points": len(upload["latitudes"]),
+        "total_distance_km": upload["cumulative_distances_km"][-1],
+        "gain_m": sum(max(b - a, 0.0) for a, b in zip(known, known[1:])),
+        "rolling_hills": len(rolling_x) // 2,
+        "grade": upload["grade"],
+    }
+
+    row = pipeline.summarise_gpx(gpx_bytes)
+    assert row.keys() == expected.keys()
+    for key in row:
+        assert math.isclose(row[key], expected[key], rel_tol=1e-9, abs_tol=1e-9), key
+
+
+def test_totals_and_table_skip_failed_files():
+    rows = [
+        {"name": "b.gpx", "points": 10, "total_distance_km": 2.5, "gain_m": 30.0, "rolling_hills": 2, "grade": 1.0},
+        {"name": "a.gpx", "points": 5, "total_distance_km": 1.5, "gain_m": 10.0, "rolling_hills": 1, "grade": -2.0},
+        {"name": "c.gpx", "error": "No valid GPS points found."},
+    ]
+    assert batch_totals(rows) == {"files": 3, "failed": 1, "total_distance_km": 4.0, "gain_m": 40.0}
+
+    lines = format_table(rows).splitlines()
+    assert [line.split()[0] for line in lines] == ["file", "a.gpx", "b.gpx", "c.gpx"]
+    assert lines[-1].endswith("error: No valid GPS points found.")
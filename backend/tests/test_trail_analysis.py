@@ -0,0 +1,73 @@
+"""The vectorized TrailAnalysis against the original calculate* loops in parseGpx."""
+import contextlib
+import io
+import math
+import os
+
+import pytest
+
+from conftest import GPX_FIXTURES
+from parseGpx import (
+    calculateDynamic,
+    calculateSegments,
+    calculateTrailStats,
+    calculateTurningPoints,
+    parse_gpx,
+)
+from trail_analysis import STRIDE_LENGTH, VERTICAL_OSCILLATION, TrailAnalysis, trail_stats, turning_points
+
+THRESHOLDS = (1, 10, 50, 100)
+SPLIT_COUNTS = (1, 5, 37, 200)
+
+
+def same(a, b) -> bool:
+    if isinstance(a, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    return math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+
+
+@pytest.fixture(params=GPX_FIXTURES, ids=os.path.basename)
+def trail(request):
+    with open(request.param, "r") as gpx_file:
+        try:
+            gpx_data = parse_gpx(gpx_file)
+        except ValueError as e:
+            pytest.skip(str(e))
+    distances = gpx_data.cumulative_distances_m.tolist()
+    elevations = gpx_data.elevations.tolist()
+    return distances, elevations, calculateTurningPoints(distances, elevations)
+
+
+def test_trail_stats(trail):
+    distances, elevations, _ = trail
+    assert same(calculateTrailStats(distances, elevations), trail_stats(distances, elevations))
+
+
+def test_turning_points(trail):
+    distances, elevations, expected = trail
+    turning_x, turning_y = turning_points(distances, elevations)
+    assert same(expected, (turning_x.tolist(), turning_y.tolist()))
+
+
+def test_rolling_hills(trail):
+    distances, elevations, (expected_x, expected_y) = trail
+    # One analysis reused across every threshold, as the trail cache does
+    analysis = TrailAnalysis(distances, elevations)
+    for threshold in THRESHOLDS:
+        expected = calculateDynamic(expected_x, expected_y, threshold, STRIDE_LENGTH, VERTICAL_OSCILLATION)
+        assert same(expected, tuple(r.tolist() for r in analysis.rolling_hills(threshold))), threshold
+
+
+def test_segments(trail):
+    distances, elevations, (expected_x, expected_y) = trail
+    index = TrailAnalysis(distances, elevations).segments
+    for threshold in THRESHOLDS:
+        for num_splits in SPLIT_COUNTS:
+            dist_per_segment = distances[-1] / num_splits
+            # calculateSegments prints as it goes
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected = calculateSegments(expected_x, expected_y, num_splits, dist_per_segment, threshold)
+            actual = index.segment_stats(num_splits, dist_per_segment, threshold)
+            assert same(expected, actual), (threshold, num_splits)
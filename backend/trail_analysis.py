@@ -0,0 +1,285 @@
+import numpy as np
+from typing import List, Optional, Tuple
+
+# Defaults used by handle_gpx_stats when filtering rolling hills
+STRIDE_LENGTH = 0.5  # meters
+VERTICAL_OSCILLATION = 0.04  # meters
+
+
+def _sequential_sum(values: np.ndarray) -> float:
+    """
+    Sum values left to right. np.cumsum accumulates in order, so the result
+    matches a plain Python `total += v` loop exactly (np.sum is pairwise).
+    """
+    if values.size == 0:
+        return 0.0
+    return float(np.cumsum(values)[-1])
+
+
+def _hypotenuse(x_diff: np.ndarray, y_diff: np.ndarray) -> np.ndarray:
+    return np.sqrt(x_diff**2 + y_diff**2)
+
+
+def trail_stats(distances, elevations) -> dict:
+    """
+    Vectorized equivalent of parseGpx.calculateTrailStats.
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    elevations = np.asarray(elevations, dtype=np.float64)
+
+    altitudeStart = float(elevations[0])
+    altitudeEnd = float(elevations[-1])
+    altitudeChange = altitudeEnd - altitudeStart
+
+    dy = np.diff(elevations)
+    dx = np.diff(distances)
+
+    # Only forward steps count, NaN elevation steps are treated as flat
+    moving = dx > 0
+    up = moving & (dy > 0)
+    down = moving & (dy < 0)
+    flat = moving & ~(dy > 0) & ~(dy < 0)
+
+    total_distance = float(distances[-1])
+    avgGrade = (altitudeChange / (total_distance if total_distance > 0 else 1)) * 100
+
+    return {
+        "altitudeChange": altitudeChange,
+        "altitudeMin": float(np.nanmin(elevations)),
+        "altitudeMax": float(np.nanmax(elevations)),
+        "altitudeStart": altitudeStart,
+        "altitudeEnd": altitudeEnd,
+        "distanceUp": _sequential_sum(dx[up]),
+        "distanceDown": _sequential_sum(dx[down]),
+        "distanceFlat": _sequential_sum(dx[flat]),
+        "grade": avgGrade,
+    }
+
+
+def turning_points(distances, elevations) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized equivalent of parseGpx.calculateTurningPoints.
+    Returns (turning_x in km, turning_y in m).
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    elevations = np.asarray(elevations, dtype=np.float64)
+
+    # The original loop starts from an elevation of 0 before the first point
+    diffs = np.diff(elevations, prepend=0.0)
+    direction = (diffs > 0).astype(np.int8) - (diffs < 0).astype(np.int8)
+
+    # A turning point is any step whose direction differs from the last non-flat step
+    moving = np.flatnonzero(direction)
+    if moving.size == 0:
+        return np.empty(0), np.empty(0)
+    directions = direction[moving]
+    changed = np.empty(moving.size, dtype=bool)
+    changed[0] = True
+    changed[1:] = directions[1:] != directions[:-1]
+
+    indices = moving[changed]
+    indices = indices[indices > 0] - 1
+
+    return distances[indices] / 1000, elevations[indices]
+
+
+class ThresholdIndex:
+    """
+    Hypotenuse lengths kept sorted alongside their positions, so the set of
+    positions shorter than any threshold is a single cutoff lookup.
+    """
+
+    def __init__(self, hypotenuse: np.ndarray, eligible: Optional[np.ndarray] = None):
+        positions = np.arange(hypotenuse.size) if eligible is None else np.flatnonzero(eligible)
+        # NaN lengths sort last and are never below a threshold
+        order = np.argsort(hypotenuse[positions], kind="stable")
+        self.sorted_hypotenuse = hypotenuse[positions][order]
+        self.positions = positions[order]
+
+    def __len__(self) -> int:
+        return self.positions.size
+
+    @property
+    def nbytes(self) -> int:
+        return self.sorted_hypotenuse.nbytes + self.positions.nbytes
+
+    def below(self, threshold: float) -> np.ndarray:
+        """Positions whose hypotenuse is < threshold, in ascending order."""
+        cutoff = np.searchsorted(self.sorted_hypotenuse, threshold, side="left")
+        return np.sort(self.positions[:cutoff])
+
+
+def _rolling_hill_index(
+    turning_x: np.ndarray,
+    turning_y: np.ndarray,
+    stride_length: float = STRIDE_LENGTH,
+    vertical_oscillation: float = VERTICAL_OSCILLATION,
+) -> ThresholdIndex:
+    # Sections between consecutive turning points that pass the stride and
+    # oscillation filters of calculateDynamic, sorted by length
+    x_diff = np.diff(turning_x) * 1000
+    y_diff = np.abs(np.diff(turning_y))
+    eligible = ~(x_diff / stride_length < 1) & ~(y_diff / vertical_oscillation < 1)
+    return ThresholdIndex(_hypotenuse(x_diff, y_diff), eligible)
+
+
+def _select_rolling_hills(
+    turning_x: np.ndarray, turning_y: np.ndarray, candidates: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    if candidates.size == 0:
+        return np.empty(0), np.empty(0)
+
+    # A candidate is skipped when the last kept section ends where it starts.
+    # Chains of such back-to-back candidates therefore keep every other one.
+    linked = np.empty(candidates.size, dtype=bool)
+    linked[0] = False
+    linked[1:] = turning_x[candidates[1:]] == turning_x[candidates[:-1] + 1]
+    positions = np.arange(candidates.size)
+    chain_start = np.maximum.accumulate(np.where(linked, 0, positions))
+    kept = candidates[(positions - chain_start) % 2 == 0]
+
+    rolling_x = np.column_stack((turning_x[kept], turning_x[kept + 1])).ravel()
+    rolling_y = np.column_stack((turning_y[kept], turning_y[kept + 1])).ravel()
+    return rolling_x, rolling_y
+
+
+def _split_indices(turning_m: np.ndarray, num_splits: int, dist_per_segment: float) -> np.ndarray:
+    # First turning point strictly past each split distance, as in calculateSegments
+    targets = dist_per_segment * np.arange(1, num_splits)
+    splits = np.searchsorted(turning_m, targets, side="right")
+    splits = splits[splits < turning_m.size]
+    return np.append(splits, turning_m.size)
+
+
+class SegmentIndex:
+    """
+    Prefix sums over the sections between turning points, so segment stats for
+    any number of splits cost one searchsorted plus O(1) per segment.
+
+    Section p runs from turning point p - 1 (wrapping) to turning point p.
+    Each segment covers the sections [start, end), so it shares its first
+    section with the previous segment. The first segment starts with the
+    section from the last turning point, exactly as the original list
+    indexing did with start - 1 = -1.
+
+    The index only depends on the turning points. Hills for a threshold come
+    from a ThresholdIndex over the section lengths, so changing the threshold
+    doesn't revisit every section either.
+    """
+
+    def __init__(self, turning_x, turning_y):
+        self.turning_x = np.asarray(turning_x, dtype=np.float64)
+        self.turning_y = np.asarray(turning_y, dtype=np.float64)
+        self.turning_m = self.turning_x * 1000
+
+        self.prev_x = np.roll(self.turning_x, 1)
+        self.prev_y = np.roll(self.turning_y, 1)
+        gains = np.where(self.turning_y > self.prev_y, self.turning_y - self.prev_y, 0.0)
+        self.gain_prefix = np.concatenate(([0.0], np.cumsum(gains)))
+        self.hypotenuse = _hypotenuse(
+            (self.turning_x - self.prev_x) * 1000, np.abs(self.turning_y - self.prev_y)
+        )
+
+        self.hill_index = ThresholdIndex(self.hypotenuse)
+
+    def __len__(self) -> int:
+        return self.turning_x.size
+
+    @property
+    def nbytes(self) -> int:
+        return sum(
+            a.nbytes
+            for a in (
+                self.turning_x,
+                self.turning_y,
+                self.turning_m,
+                self.prev_x,
+                self.prev_y,
+                self.gain_prefix,
+                self.hypotenuse,
+            )
+        ) + self.hill_index.nbytes
+
+    def bounds(self, num_splits: int, dist_per_segment: float) -> np.ndarray:
+        """
+        End index (exclusive) of each segment into the turning points.
+        The first turning point past each split distance starts a new segment.
+        """
+        return _split_indices(self.turning_m, num_splits, dist_per_segment)
+
+    def hills(self, threshold: float) -> np.ndarray:
+        """Sections shorter than threshold, in ascending order."""
+        return self.hill_index.below(threshold)
+
+    def segment_stats(
+        self, num_splits: int, dist_per_segment: float, threshold: float
+    ) -> Tuple[List[dict], List[float]]:
+        """Vectorized equivalent of parseGpx.calculateSegments, up to float rounding of the gains."""
+        ends = self.bounds(num_splits, dist_per_segment)
+        starts = np.concatenate(([0], ends[:-1]))
+        segment_x_positions = self.turning_x[starts].tolist()
+        all_hills = self.hills(threshold)
+
+        # Drop segments with no sections (only possible when there are no turning points)
+        kept = ends != 0
+        starts, ends = starts[kept], ends[kept]
+
+        gains = self.gain_prefix[ends] - self.gain_prefix[starts]
+        hill_starts = np.searchsorted(all_hills, starts)
+        hillcounts = np.searchsorted(all_hills, ends) - hill_starts
+        rise = self.turning_y[ends - 1] - self.prev_y[starts]
+        run = self.turning_x[ends - 1] - self.prev_x[starts]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            grades = np.where(run != 0, rise / (run * 1000), 0.0)
+
+        stats = []
+        for start, gain, hillcount, grade in zip(
+            hill_starts.tolist(), gains.tolist(), hillcounts.tolist(), grades.tolist()
+        ):
+            hills = all_hills[start:start + hillcount]
+            stats.append(
+                {
+                    "gain": gain,
+                    "hillcount": hillcount,
+                    "rolling_x": np.column_stack((self.prev_x[hills], self.turning_x[hills])).ravel().tolist(),
+                    "rolling_y": np.column_stack((self.prev_y[hills], self.turning_y[hills])).ravel().tolist(),
+                    "grade": grade,
+                }
+            )
+        return stats, segment_x_positions
+
+
+class TrailAnalysis:
+    """
+    The parts of handle_gpx_stats that don't depend on threshold or split count,
+    computed once per trail so later parameter changes can reuse them.
+    """
+
+    def __init__(self, distances, elevations):
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.elevations = np.asarray(elevations, dtype=np.float64)
+        self.stats = trail_stats(self.distances, self.elevations)
+        self.turning_x, self.turning_y = turning_points(self.distances, self.elevations)
+        self.segments = SegmentIndex(self.turning_x, self.turning_y)
+        self.rolling = _rolling_hill_index(self.turning_x, self.turning_y)
+
+    @property
+    def total_distance(self) -> float:
+        return float(self.distances[-1])
+
+    @property
+    def nbytes(self) -> int:
+        # The point columns are shared with whoever passed them in as arrays
+        return (
+            self.turning_x.nbytes
+            + self.turning_y.nbytes
+            + self.segments.nbytes
+            + self.rolling.nbytes
+        )
+
+    def rolling_hills(self, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Vectorized equivalent of parseGpx.calculateDynamic, from the sorted section lengths.
+        Returns flat (rolling_x, rolling_y) arrays holding the start and end of each hill.
+        """
+        return _select_rolling_hills(self.turning_x, self.turning_y, self.rolling.below(threshold))
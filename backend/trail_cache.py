@@ -0,0 +1,152 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from parseGpx import GPXData
+from trail_analysis import TrailAnalysis
+
+
+@dataclass
+class _CachedTrail:
+    latitudes: np.ndarray
+    longitudes: np.ndarray
+    elevations: np.ndarray
+    cumulative_distances_m: np.ndarray
+    expires_at: float
+    analysis: Optional[TrailAnalysis] = None
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.latitudes.nbytes
+            + self.longitudes.nbytes
+            + self.elevations.nbytes
+            + self.cumulative_distances_m.nbytes
+            + (self.analysis.nbytes if self.analysis is not None else 0)
+        )
+
+
+class TrailCache:
+    """
+    Bounded in-process LRU cache of parsed trails, keyed by trail ID.
+
+    Only the per-point columns are kept, as float64 arrays, plus the trail's
+    TrailAnalysis once get_analysis has built it. Entries expire
+    ttl seconds after they were last used, and the least recently used
+    entries are evicted once max_entries or max_bytes is exceeded.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 60 * 60,
+        max_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, _CachedTrail]" = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __contains__(self, trail_id: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(trail_id)
+            return entry is not None and entry.expires_at > time.monotonic()
+
+    def put(self, gpx_data: GPXData, trail_id: Optional[str] = None) -> str:
+        """
+        Store the trail's point columns and return its trail ID. A new ID is
+        made up unless one is given, e.g. one derived from the upload's content.
+        """
+        entry = _CachedTrail(
+            latitudes=np.asarray(gpx_data.latitudes, dtype=np.float64),
+            longitudes=np.asarray(gpx_data.longitudes, dtype=np.float64),
+            elevations=np.asarray(gpx_data.elevations, dtype=np.float64),
+            cumulative_distances_m=np.asarray(gpx_data.cumulative_distances_m, dtype=np.float64),
+            expires_at=time.monotonic() + self.ttl,
+        )
+        trail_id = trail_id or uuid.uuid4().hex
+
+        with self._lock:
+            if trail_id in self._entries:
+                self._remove(trail_id)
+            self._entries[trail_id] = entry
+            self._nbytes += entry.nbytes
+            self._evict(time.monotonic())
+        return trail_id
+
+    def get(self, trail_id: str) -> Optional[GPXData]:
+        """
+        Return a fresh GPXData for the trail, or None if it is unknown or expired.
+        Its columns are the cached arrays, so replace them rather than
+        modifying them in place.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(trail_id)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                self._remove(trail_id)
+                return None
+            entry.expires_at = now + self.ttl
+            self._entries.move_to_end(trail_id)
+
+        return GPXData(
+            latitudes=entry.latitudes,
+            longitudes=entry.longitudes,
+            elevations=entry.elevations,
+            cumulative_distances_m=entry.cumulative_distances_m,
+        )
+
+    def get_analysis(self, trail_id: str) -> Optional[TrailAnalysis]:
+        """
+        Return the trail's TrailAnalysis, building it on first use, or None if
+        the trail is unknown or expired. Pass it to handle_gpx_stats so only
+        the threshold and split dependent work is redone.
+        """
+        with self._lock:
+            entry = self._entries.get(trail_id)
+            if entry is None:
+                return None
+            if entry.analysis is not None:
+                return entry.analysis
+
+        # Built outside the lock, a concurrent request may build it too and one copy wins
+        analysis = TrailAnalysis(entry.cumulative_distances_m, entry.elevations)
+        with self._lock:
+            if self._entries.get(trail_id) is not entry:
+                return analysis
+            if entry.analysis is None:
+                entry.analysis = analysis
+                self._nbytes += analysis.nbytes
+                self._evict(time.monotonic())
+            return entry.analysis
+
+    def _remove(self, trail_id: str):
+        entry = self._entries.pop(trail_id)
+        self._nbytes -= entry.nbytes
+
+    def _evict(self, now: float):
+        # Drop expired entries, then the least recently used until within budget
+        for trail_id in [k for k, e in self._entries.items() if e.expires_at <= now]:
+            self._remove(trail_id)
+
+        while self._entries and (
+            len(self._entries) > self.max_entries or self._nbytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
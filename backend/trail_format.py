@@ -0,0 +1,198 @@
+"""
+Compact binary encoding of a processed trail.
+
+The JSON response repeats every per-point array as text, which is most of
+its size and of the time spent encoding and decoding it. This format sends
+the same payload as a small JSON header followed by raw little-endian
+column buffers:
+
+    magic       4 bytes   b"TRLC"
+    version     1 byte
+    padding     3 bytes
+    header_len  uint32 little-endian
+    header      header_len bytes of UTF-8 JSON, padded with spaces to 8 bytes
+    buffers     one per column, each starting on an 8 byte boundary
+
+The header holds the summary stats (see convert_gpx_data_summary), any
+extra fields such as trail_id, and a "columns" list of
+{name, dtype, offset, length}. Offsets are from the start of the buffers
+section. Missing elevations are NaN. cumulative_distances_km is left out,
+it is cumulative_distances_m / 1000.
+
+For clients that want text, iter_trail_ndjson streams the same header and
+columns as newline-delimited JSON, one chunk of a column per line.
+"""
+import json
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from parseGpx import GPXData, convert_gpx_data_summary, to_json_list
+
+TRAIL_COLUMNS_MEDIA_TYPE = "application/vnd.trailrunners.columns"
+TRAIL_NDJSON_MEDIA_TYPE = "application/x-ndjson"
+MAGIC = b"TRLC"
+VERSION = 1
+
+_PREAMBLE = struct.Struct("<4sB3xI")
+_ALIGN = 8
+
+# (name, dtype) of each column, in buffer order
+COLUMNS = (
+    ("latitudes", "<f8"),
+    ("longitudes", "<f8"),
+    ("cumulative_distances_m", "<f8"),
+    ("elevations", "<f4"),
+    ("turning_x", "<f8"),
+    ("turning_y", "<f8"),
+    ("rolling_x", "<f8"),
+    ("rolling_y", "<f8"),
+)
+
+
+# Sent exactly, also when the per-point columns are replaced by a reduced level of detail
+MARKER_COLUMNS = ("turning_x", "turning_y", "rolling_x", "rolling_y")
+
+LOD_DTYPES = {
+    "lod_distances_km": "<f8",
+    "lod_elevations": "<f4",
+    "lod_latitudes": "<f8",
+    "lod_longitudes": "<f8",
+}
+
+
+def _padding(size: int) -> int:
+    return -size % _ALIGN
+
+
+def _accepts(accept: Optional[str], wanted: str) -> bool:
+    if not accept:
+        return False
+    for media_range in accept.split(","):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        if media_type.lower() != wanted:
+            continue
+        # An explicit q=0 means "not acceptable"
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def wants_trail_columns(accept: Optional[str]) -> bool:
+    """True if an Accept header asks for the binary format over JSON."""
+    return _accepts(accept, TRAIL_COLUMNS_MEDIA_TYPE)
+
+
+def wants_trail_ndjson(accept: Optional[str]) -> bool:
+    """True if an Accept header asks for the streamed NDJSON format (see iter_trail_ndjson) over JSON."""
+    return _accepts(accept, TRAIL_NDJSON_MEDIA_TYPE)
+
+
+def _column_sources(data: GPXData, lod: Optional[Dict[str, np.ndarray]]) -> List[Tuple[str, str, object]]:
+    # (name, dtype, values) of each column sent, the lod columns replace the per-point ones
+    if lod is None:
+        return [(name, dtype, getattr(data, name)) for name, dtype in COLUMNS]
+    sources = [(name, LOD_DTYPES[name], values) for name, values in lod.items()]
+    sources += [(name, dtype, getattr(data, name)) for name, dtype in COLUMNS if name in MARKER_COLUMNS]
+    return sources
+
+
+def encode_trail_columns(data: GPXData, lod: Optional[Dict[str, np.ndarray]] = None, **extra) -> bytes:
+    """
+    Encode a processed trail, plus any extra header fields, as bytes.
+    With lod (from lod.decimate_trail), its columns are sent instead of the per-point ones.
+    """
+    buffers = []
+    columns = []
+    offset = 0
+    for name, dtype, values in _column_sources(data, lod):
+        # None elevations become NaN
+        buffer = np.asarray(values, dtype=np.float64).astype(dtype, copy=False).tobytes()
+        columns.append({"name": name, "dtype": dtype, "offset": offset, "length": len(values)})
+        buffers.append(buffer)
+        buffers.append(b"\0" * _padding(len(buffer)))
+        offset += len(buffer) + _padding(len(buffer))
+
+    header = convert_gpx_data_summary(data)
+    header.update(extra)
+    header["columns"] = columns
+    header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    header_bytes += b" " * _padding(_PREAMBLE.size + len(header_bytes))
+
+    return b"".join([_PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)), header_bytes, *buffers])
+
+
+def decode_trail_columns(buffer: bytes) -> dict:
+    """
+    Decode bytes from encode_trail_columns into a dict with the header fields
+    and one numpy array per column. The arrays are views into buffer.
+    """
+    magic, version, header_len = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a trail columns buffer.")
+    if version != VERSION:
+        raise ValueError(f"Unsupported trail columns version: {version}")
+
+    header_end = _PREAMBLE.size + header_len
+    result = json.loads(bytes(buffer[_PREAMBLE.size:header_end]))
+    for column in result.pop("columns"):
+        result[column["name"]] = np.frombuffer(
+            buffer,
+            dtype=column["dtype"],
+            count=column["length"],
+            offset=header_end + column["offset"],
+        )
+    return result
+
+
+def iter_trail_ndjson(
+    data: GPXData, lod: Optional[Dict[str, np.ndarray]] = None, chunk_size: int = 10_000, **extra
+) -> Iterator[bytes]:
+    """
+    Yield a processed trail as newline-delimited JSON, for a streaming response.
+
+    The first line holds the summary stats, any extra fields and a "columns"
+    list of {name, length}, so a client can show the stats before the points
+    arrive. Each following line is {"name", "offset", "values"} with up to
+    chunk_size values of one column, latitudes and longitudes first. Only one
+    chunk is converted to text at a time. Missing elevations are null.
+    """
+    sources = _column_sources(data, lod)
+    header = convert_gpx_data_summary(data)
+    header.update(extra)
+    header["columns"] = [{"name": name, "length": len(values)} for name, _, values in sources]
+    yield json.dumps(header, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    for name, _, values in sources:
+        values = np.asarray(values, dtype=np.float64)
+        for offset in range(0, len(values), chunk_size):
+            line = {"name": name, "offset": offset, "values": to_json_list(values[offset:offset + chunk_size])}
+            yield json.dumps(line, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+# Point columns of a trail, in the order encode_trail_points writes them
+POINT_COLUMNS = ("latitudes", "longitudes", "elevations", "cumulative_distances_m")
+
+
+def encode_trail_points(data: GPXData) -> bytes:
+    """
+    The trail's per-point columns as consecutive float64 buffers, at full
+    precision, e.g. to restore it to the trail cache later.
+    """
+    return b"".join(
+        np.asarray(getattr(data, name), dtype=np.float64).astype("<f8", copy=False).tobytes()
+        for name in POINT_COLUMNS
+    )
+
+
+def decode_trail_points(buffer: bytes) -> GPXData:
+    """Read bytes from encode_trail_points back into a GPXData with numpy columns."""
+    columns = np.frombuffer(buffer, dtype="<f8").reshape(len(POINT_COLUMNS), -1)
+    return GPXData(**dict(zip(POINT_COLUMNS, columns)))
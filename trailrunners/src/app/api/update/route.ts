@@ -4,8 +4,11 @@ const API_URL = process.env.NEXT_PUBLIC_FASTAPI_BASE_URL;
 
 export async function POST(req: Request) {
     const body = await req.json();
-    
-    const res = await fetch(`${API_URL}/update`, {
+
+    // Trails cached by the backend only need their id, otherwise send the full arrays
+    const endpoint = body.trail_id && !body.elevations ? "update-trail" : "update";
+
+    const res = await fetch(`${API_URL}/${endpoint}`, {
         method: "POST",
         headers: { 
             "Content-Type": "application/json" 
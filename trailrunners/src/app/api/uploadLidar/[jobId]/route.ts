@@ -0,0 +1,25 @@
+import { NextRequest, NextResponse } from "next/server";
+
+const API_URL = process.env.NEXT_PUBLIC_FASTAPI_BASE_URL;
+
+// One poll of a LiDAR job submitted through /api/uploadLidar:
+// 202 while it runs, then the processed trail (or the job's error)
+export async function GET(
+  request: NextRequest,
+  { params }: { params: Promise<{ jobId: string }> }
+) {
+  const { jobId } = await params;
+
+  try {
+    const res = await fetch(`${API_URL}/jobs/${encodeURIComponent(jobId)}/result`);
+    const data = await res.json();
+    return NextResponse.json(data, { status: res.status });
+  } catch (error) {
+    console.error(`Error fetching LIDAR job ${jobId}: ${error}`);
+
+    return NextResponse.json(
+      { error: "Error fetching LIDAR job" },
+      { status: 500 }
+    );
+  }
+}
@@ -52,17 +52,18 @@ export async function POST(request: NextRequest) {
         }
     }
  
-    // make the request to the FastAPI server
-    const fastApiRes = await fetch(`${API_URL}/process-lidar`, {
+    // submit a background job to the FastAPI server
+    const submitRes = await fetch(`${API_URL}/jobs/process-lidar`, {
       method: "POST",
       body: formDataToSend,
     });
-    if (!fastApiRes.ok) {
-      throw new Error(`${fastApiRes.status}`);
+    if (!submitRes.ok) {
+      throw new Error(`${submitRes.status}`);
     }
-    const result = await fastApiRes.json();
+    const { job_id } = await submitRes.json();
 
-    return NextResponse.json(result);
+    // The browser polls /api/uploadLidar/<job_id> for the result, so no request stays open for the whole pipeline
+    return NextResponse.json({ job_id }, { status: 202 });
   } catch (error) {
     console.error(`Error processing LIDAR data: ${error}`);
 
@@ -22,6 +22,7 @@ interface TrailData {
     longitudes: number[];
     turning_x: number[];
     turning_y: number[];
+    trail_id?: string;
 }
 
 interface Parameters {
@@ -64,21 +65,33 @@ export default function ControlPanel({ trailData, setTrailData }: DashboardProps
             if (pending) return;
             setPending(true)
 
-            // Fetches via exposed enpoint
-            const promise = await fetch(`/api/update`, {
+            // Fill in value with previous one if not provided
+            const params = {
+                threshold: threshold ? threshold : thresh,
+                segments: segments ? segments : segs,
+            };
+
+            const postUpdate = (body: object) => fetch(`/api/update`, {
                 method: "POST",
                 headers: { "Content-Type": "application/json" },
-                body: JSON.stringify({
+                body: JSON.stringify(body),
+            });
+
+            // Fetches via exposed enpoint, only sending the trail id when the backend has it cached
+            let promise = trailData.trail_id
+                ? await postUpdate({ trail_id: trailData.trail_id, ...params })
+                : null;
+
+            // Cache miss (or no id), resend the whole trail
+            if (!promise || promise.status === 404) {
+                promise = await postUpdate({
                     elevations: trailData.elevations,
                     latitudes: trailData.latitudes,
                     longitudes: trailData.longitudes,
                     cumulative_distances_m: trailData.cumulative_distances_m,
-
-                    // Fill in value with previous one if not provided
-                    threshold: threshold ? threshold : thresh,
-                    segments: segments ? segments : segs,
-                }),
-            })
+                    ...params,
+                });
+            }
 
             const data = await promise.json();
             setPending(false)
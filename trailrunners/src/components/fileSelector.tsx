@@ -11,6 +11,8 @@ interface FileSelectorConfig {
   acceptedFileTypes: string;
   uploadEndpoint: string;
   fetchEndpoint?: string;
+  // Set when uploadEndpoint answers with a background job_id, polled at `${jobEndpoint}/${job_id}`
+  jobEndpoint?: string;
   uploadMessages?: {
     pending: string;
     success: string;
@@ -48,6 +50,26 @@ export interface FileItem {
   file?: File;
 }
 
+// Background jobs are polled this often, and given up on after JOB_TIMEOUT_MS
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_TIMEOUT_MS = 10 * 60 * 1000;
+
+// Polls a background job until it has a result, each poll is a short request
+async function waitForJob(jobEndpoint: string, jobId: string) {
+  const deadline = Date.now() + JOB_TIMEOUT_MS;
+  while (Date.now() < deadline) {
+    const res = await fetch(`${jobEndpoint}/${jobId}`);
+    if (res.status !== 202) {
+      if (!res.ok) {
+        throw new Error(`Job failed: ${res.status}`);
+      }
+      return res.json();
+    }
+    await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+  }
+  throw new Error("Job timed out");
+}
+
 const defaultConfig: Partial<FileSelectorConfig> = {
   uploadMessages: {
     pending: "Uploading file...",
@@ -136,6 +158,15 @@ export default function FileSelector({
     };
   }, [toggled]);
 
+  // Reads an upload endpoint's response, waiting for the job it started if it runs one
+  const readResult = async (res: Response) => {
+    const data = await res.json();
+    if (config.jobEndpoint && data?.job_id) {
+      return waitForJob(config.jobEndpoint, data.job_id);
+    }
+    return data;
+  };
+
   // Loads the selected file and sends file to endpoint
   const handleUpload = async (event: React.ChangeEvent<HTMLInputElement>) => {
     const file = event.target.files?.[0];
@@ -174,7 +205,7 @@ export default function FileSelector({
         if (!res.ok) {
           throw new Error("Upload failed");
         }
-        return res.json();
+        return readResult(res);
       });
 
       const result = await toast.promise(promise, mergedConfig.uploadMessages!);
@@ -215,7 +246,7 @@ export default function FileSelector({
         body: formData,
       }).then(async (res) => {
         if (!res.ok) throw new Error("Processing failed");
-        return res.json();
+        return readResult(res);
       });
 
       const result = await toast.promise(
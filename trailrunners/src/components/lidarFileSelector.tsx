@@ -34,6 +34,7 @@ export default function LidarFileSelector({firstUse = false, setTrailData, selec
             config={{
                 acceptedFileTypes: ".laz,.las",
                 uploadEndpoint: "/api/uploadLidar",
+                jobEndpoint: "/api/uploadLidar",
                 fetchEndpoint: "/api/lidarFiles",
                 uploadMessages: {
                     pending: "Uploading LIDAR file...",